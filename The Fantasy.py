@@ -88,10 +88,31 @@ import random
 import os
 import math
 import sys
+import json
+import threading
+import queue
+import asyncio
+import concurrent.futures
+import tempfile
+import heapq
+import types
+import collections
+import multiprocessing
+import struct
+import signal
 import textwrap
+import time
+import timeit
+import tracemalloc
 import warnings
 warnings.filterwarnings("ignore", category=SyntaxWarning)
 
+# NumPy n'est utile que pour la simulation en masse, le jeu marche sans
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 CLASS_LOGOS = {
     "Chevalier": r"""
  ,.
@@ -1067,54 +1088,343 @@ ___________________________________________|0oOO0oO0o|____________
  \/      /____/\____\
 """}
 
+# ---------------------------
+# Rendu des ASCII arts
+# ---------------------------
+# Chaque art n'est découpé et mesuré qu'une fois ; le bloc final (centré ou
+# tronqué) est gardé pour chaque couple (art, largeur du terminal) et écrit en un
+# seul appel. La largeur n'est relue qu'après un redimensionnement (SIGWINCH).
+
+ART_CACHE_SIZE = 64
+DEFAULT_TERM_WIDTH = 80  # valeur par défaut si pas de terminal détecté
+
+class ArtCache:
+    """Blocs prêts à écrire par (art, largeur), au plus size blocs (les moins récents sont oubliés)."""
+
+    def __init__(self, size=ART_CACHE_SIZE):
+        self.size = size
+        # art -> (lignes, largeur) : les arts sont fixes, ce dict ne grossit pas pendant le jeu
+        self.shapes = {}
+        self.blocks = collections.OrderedDict()
+        # None = largeur à relire ; sans SIGWINCH on la relit à chaque affichage
+        self.term_width = None
+        self.watching = False
+        # incrémenté par SIGWINCH ; block() vide le cache quand il voit un nouveau numéro
+        self.generation = 0
+        self.seen_generation = 0
+        self.hits = self.misses = 0
+
+    def shape(self, art):
+        """(lignes, largeur) de l'art, calculées une seule fois."""
+        shape = self.shapes.get(art)
+        if shape is None:
+            lines = tuple(art.split('\n'))
+            shape = self.shapes[art] = (lines, max((len(line) for line in lines), default=0))
+        return shape
+
+    def width(self):
+        if self.seen_generation != self.generation:
+            # redimensionné depuis le dernier affichage : anciens blocs et ancienne largeur oubliés
+            self.seen_generation = self.generation
+            self.term_width = None
+            self.blocks.clear()
+        if self.term_width is not None:
+            return self.term_width
+        try:
+            width = os.get_terminal_size().columns
+        except OSError:
+            width = DEFAULT_TERM_WIDTH
+        if self.watching:
+            self.term_width = width
+        return width
+
+    def block(self, art):
+        """Texte à écrire pour afficher l'art dans le terminal actuel (avec le saut de ligne final)."""
+        key = (art, self.width())
+        block = self.blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return block
+        self.misses += 1
+        block = self.blocks[key] = self.render(art, key[1])
+        if len(self.blocks) > self.size:
+            self.blocks.popitem(last=False)
+        return block
+
+    def render(self, art, term_width):
+        lines, art_width = self.shape(art)
+        if art_width > term_width:
+            # Terminal trop étroit : on prévient et on tronque chaque ligne
+            out = [f"[ Agrandissez votre terminal pour un meilleur affichage ({art_width} colonnes recommandées) ]"]
+            out.extend(line[:term_width] for line in lines)
+        else:
+            # Terminal assez large : on centre l'ASCII art
+            pad = ' ' * ((term_width - art_width) // 2)
+            out = [pad + line for line in lines]
+        out.append('')
+        return '\n'.join(out)
+
+    def resized(self, *_):
+        """
+        Gestionnaire de SIGWINCH. Il peut tomber au milieu de block() : il ne touche
+        donc pas au cache et change seulement de génération (voir width()).
+        """
+        self.generation += 1
+
+    def watch_resize(self):
+        """Installe le gestionnaire de SIGWINCH (Unix, thread principal) ; sinon la largeur reste relue à chaque fois."""
+        if self.watching or not hasattr(signal, 'SIGWINCH'):
+            return
+        try:
+            signal.signal(signal.SIGWINCH, self.resized)
+        except ValueError:
+            return  # pas dans le thread principal
+        self.watching = True
+
+ART_CACHE = ArtCache()
+
 def print_ascii(art):
     """Affiche un ASCII art en l'adaptant à la largeur du terminal."""
-    try:
-        term_width = os.get_terminal_size().columns
-    except OSError:
-        term_width = 80  # valeur par défaut si pas de terminal détecté
-
-    lines = art.split('\n')
-    art_width = max((len(line) for line in lines), default=0)
-
-    if art_width > term_width:
-        # Terminal trop étroit : on prévient et on tronque chaque ligne
-        print(f"[ Agrandissez votre terminal pour un meilleur affichage ({art_width} colonnes recommandées) ]")
-        for line in lines:
-            print(line[:term_width])
-    else:
-        # Terminal assez large : on centre l'ASCII art
-        pad = (term_width - art_width) // 2
-        for line in lines:
-            print(' ' * pad + line)
+    sys.stdout.write(ART_CACHE.block(art))
+
+# ---------------------------
+# Sortie d'une partie, image par image
+# ---------------------------
+# Le combat et l'aventure n'appellent plus print : ils ajoutent leurs lignes à
+# l'image en cours (session.output), écrite d'un coup juste avant chaque question.
+# Chaque ligne est protégée par un test de niveau, ce qui évite même de formater
+# le texte quand personne ne le lira (parties sans joueur, benchmarks).
+
+# niveaux de détail, du plus discret au plus bavard
+VERBOSITY_SILENT = 0  # rien
+VERBOSITY_STEPS = 1   # étapes, rencontres et issue des combats
+VERBOSITY_TURNS = 2   # en plus, le détail de chaque tour de combat
+
+class FrameOutput:
+    """Texte de l'image en cours, écrit en un seul appel par flush()."""
+    __slots__ = ('level', 'stream', 'parts')
+
+    def __init__(self, level=VERBOSITY_TURNS, stream=None):
+        self.level = level
+        # None = sys.stdout au moment d'écrire (suit contextlib.redirect_stdout)
+        self.stream = stream
+        self.parts = []
+
+    def line(self, text):
+        self.parts.append(text)
+        self.parts.append('\n')
+
+    def art(self, art):
+        self.parts.append(ART_CACHE.block(art))
+
+    def flush(self):
+        if self.parts:
+            (self.stream or sys.stdout).write(''.join(self.parts))
+            self.parts.clear()
+
+class NullFrames:
+    """Sortie qui n'affiche rien : son niveau est VERBOSITY_SILENT, donc aucune ligne n'est même formatée."""
+    __slots__ = ()
+    level = VERBOSITY_SILENT
+
+    def line(self, text):
+        pass
+
+    def art(self, art):
+        pass
+
+    def flush(self):
+        pass
+
+NULL_FRAMES = NullFrames()
 
 DB = "fantasy.db"
 
 # ---------------------------
-# Création et initialisation
+# Connexions à la base
 # ---------------------------
+# Toutes les requêtes du jeu ont un nom et un texte fixe : sqlite3 garde chaque
+# requête compilée dans le cache de sa connexion et la réutilise à chaque appel.
+QUERIES = {
+    'nouveau_joueur': """INSERT INTO Joueur (nom, id_classe, id_competence, exp, pv, attaque, niveau, compte)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+    # le nom de la classe est ajouté par get_player (voir CONTENT)
+    'joueur': """SELECT id_joueur, nom, id_classe, id_competence, exp, pv, attaque, niveau,
+                        boss_vaincus, meilleur_tours
+                 FROM Joueur WHERE id_joueur = ?""",
+    'dernier_joueur': """SELECT id_joueur, nom, id_classe, id_competence, exp, pv, attaque, niveau,
+                                boss_vaincus, meilleur_tours
+                         FROM Joueur ORDER BY id_joueur DESC LIMIT 1""",
+    'joueur_compte_nom': """SELECT id_joueur, nom, id_classe, id_competence, exp, pv, attaque, niveau,
+                                   boss_vaincus, meilleur_tours
+                            FROM Joueur WHERE compte = ? AND nom = ?
+                            ORDER BY id_joueur DESC LIMIT 1""",
+    # pagination par clé : on repart du dernier id vu au lieu d'un OFFSET qui relit tout le début
+    'joueurs_compte': """SELECT id_joueur, nom, id_classe, niveau, exp FROM Joueur
+                         WHERE compte = ? AND id_joueur > ?
+                         ORDER BY id_joueur LIMIT ?""",
+    'classement': """SELECT id_joueur, nom, id_classe, niveau, exp FROM Joueur
+                     ORDER BY niveau DESC, exp DESC, id_joueur DESC LIMIT ?""",
+    'classement_suite': """SELECT id_joueur, nom, id_classe, niveau, exp FROM Joueur
+                           WHERE (niveau, exp, id_joueur) < (?, ?, ?)
+                           ORDER BY niveau DESC, exp DESC, id_joueur DESC LIMIT ?""",
+    'classement_boss': """SELECT id_joueur, nom, id_classe, boss_vaincus, niveau FROM Joueur
+                          ORDER BY boss_vaincus DESC, niveau DESC, id_joueur DESC LIMIT ?""",
+    'classement_rapide': """SELECT id_joueur, nom, id_classe, meilleur_tours FROM Joueur
+                            WHERE meilleur_tours IS NOT NULL
+                            ORDER BY meilleur_tours, id_joueur LIMIT ?""",
+    'cles_classement': "SELECT niveau, exp, boss_vaincus, meilleur_tours FROM Joueur WHERE id_joueur = ?",
+    # rang = 1 + nombre de héros strictement devant (les ex aequo ont le même rang)
+    # niveaux au-dessus, puis meilleure exp au même niveau (voir la migration 6)
+    'rang_niveau': """SELECT 1 + COALESCE((SELECT SUM(nb) FROM ClassementParNiveau WHERE niveau > ?1), 0)
+                         + COALESCE((SELECT SUM(nb) FROM ClassementNiveau WHERE niveau = ?1 AND exp > ?2), 0)""",
+    'rang_boss': "SELECT 1 + COALESCE(SUM(nb), 0) FROM ClassementBoss WHERE (boss_vaincus, niveau) > (?, ?)",
+    'rang_rapide': "SELECT 1 + COALESCE(SUM(nb), 0) FROM ClassementRapide WHERE tours < ?",
+    'stats_classes': """SELECT id_classe, heros, somme_niveau * 1.0 / heros, max_niveau, boss_vaincus, meilleur_tours
+                        FROM StatsClasse WHERE heros > 0 ORDER BY id_classe""",
+    # un champ à None garde sa valeur : une seule requête quels que soient les champs modifiés
+    'maj_joueur': """UPDATE Joueur SET pv = COALESCE(?, pv), exp = COALESCE(?, exp),
+                            attaque = COALESCE(?, attaque), niveau = COALESCE(?, niveau),
+                            boss_vaincus = COALESCE(?, boss_vaincus), meilleur_tours = COALESCE(?, meilleur_tours)
+                     WHERE id_joueur = ?""",
+    'versions': "SELECT cle, valeur FROM Version",
+    'heros_synthetique': """INSERT INTO Joueur (nom, id_classe, id_competence, exp, pv, attaque, niveau, compte,
+                                                boss_vaincus, meilleur_tours)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'journal_combat': """INSERT INTO CombatLog (id_joueur, id_ennemi, tour, choix, degats_infliges, degats_subis,
+                                                pv_joueur, pv_ennemi, issue)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+}
 
-# On vérifie qu'il n'y pas de base de donnée du jeu déja existente, sinon on la supprime
-# ca évite les problème en cas de modification de la base de donnée
+# réglages appliqués à chaque nouvelle connexion
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",      # les lecteurs ne bloquent plus l'écrivain (et inversement)
+    "PRAGMA busy_timeout = 5000",     # attend 5 s au lieu d'échouer si la base est occupée
+    "PRAGMA synchronous = NORMAL",    # suffisant avec WAL, beaucoup moins de fsync
+    "PRAGMA cache_size = -8000",      # 8 Mo de cache de pages
+    "PRAGMA temp_store = MEMORY",
+)
 
-def init_db():
-    if os.path.exists(DB):
-        os.remove(DB)
-    need_setup = not os.path.exists(DB)
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+class Database:
+    """
+    Gestionnaire de connexions pour une base : une connexion par thread, réglée par PRAGMAS.
+    Une base ':memory:' n'existe que dans sa connexion, tous les threads partagent donc la même.
+    """
+    def __init__(self, path=DB):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.shared = self._connect() if path == ":memory:" else None
+
+    def _connect(self):
+        # chaque thread a sa connexion, mais close() doit pouvoir toutes les fermer
+        conn = sqlite3.connect(self.path, timeout=5.0, cached_statements=2 * len(QUERIES) + 32,
+                               check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def connection(self):
+        if self.shared is not None:
+            return self.shared
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.total_changes  # ProgrammingError si quelqu'un l'a fermée
+                return conn
+            except sqlite3.ProgrammingError:
+                pass
+        conn = self.local.conn = self._connect()
+        return conn
+
+    def execute(self, name, params=()):
+        """Exécute la requête nommée name de QUERIES."""
+        return self.connection().execute(QUERIES[name], params)
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.shared = None
+        self.local = threading.local()
+        if _databases.get(self.path) is self:
+            del _databases[self.path]
+
+    def snapshot_to(self, path):
+        """Copie la base dans le fichier path (API de sauvegarde de SQLite), d'un coup."""
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        dest = sqlite3.connect(tmp)
+        try:
+            self.connection().backup(dest)
+        finally:
+            dest.close()
+        os.replace(tmp, path)
+
+# copie d'une base en mémoire sur le disque toutes les MEMORY_SNAPSHOT_INTERVAL secondes
+MEMORY_SNAPSHOT_INTERVAL = 30.0
+
+class DiskSnapshots:
+    """Thread qui copie db dans path à intervalle régulier, et une dernière fois à stop()."""
+    def __init__(self, db, path, interval=MEMORY_SNAPSHOT_INTERVAL):
+        self.db = db
+        self.path = path
+        self.interval = interval
+        self.copies = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="fantasy-copie", daemon=True)
+        self.thread.start()
 
-    # On exécute le schema + inserts si nécessaire
-    cur.execute("""CREATE TABLE IF NOT EXISTS Classe (
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.db.snapshot_to(self.path)
+            self.copies += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.db.snapshot_to(self.path)
+        self.copies += 1
+
+# un gestionnaire par fichier (les bases ':memory:' sont toujours neuves)
+_databases = {}
+
+def open_database(path=DB):
+    if path == ":memory:":
+        return Database(path)
+    db = _databases.get(path)
+    if db is None:
+        db = _databases[path] = Database(path)
+    return db
+
+# ---------------------------
+# Création et initialisation
+# ---------------------------
+
+# La base n'est plus supprimée à chaque lancement (les héros sauvegardés restent) :
+# la table Version garde la version du schéma et une empreinte des données de départ.
+# Si tout est à jour, init_db ne fait qu'une requête ; sinon il applique les
+# migrations manquantes et ne réinsère que les tables dont les données ont changé.
+
+# migration n : ce qui fait passer le schéma de la version n-1 à la version n
+MIGRATIONS = [
+    # 1 : les quatre tables du jeu
+    [
+        """CREATE TABLE IF NOT EXISTS Classe (
         id_classe INTEGER PRIMARY KEY,
         nom TEXT NOT NULL,
         pv_base INTEGER,
         attaque_base INTEGER,
         nom_competence TEXT NOT NULL,
         effet TEXT NOT NULL
-    );""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS Competence (
+    );""",
+        """CREATE TABLE IF NOT EXISTS Competence (
         id_competence INTEGER PRIMARY KEY,
         id_classe INTEGER,
         nom TEXT,
@@ -1123,9 +1433,8 @@ def init_db():
         bonus_attaque INTEGER,
         duree_tours INTEGER,
         FOREIGN KEY (id_classe) REFERENCES Classe(id_classe)
-    );""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS Joueur (
+    );""",
+        """CREATE TABLE IF NOT EXISTS Joueur (
         id_joueur INTEGER PRIMARY KEY,
         nom TEXT,
         id_classe INTEGER,
@@ -1136,146 +1445,563 @@ def init_db():
         niveau INTEGER,
         FOREIGN KEY (id_classe) REFERENCES Classe(id_classe),
         FOREIGN KEY (id_competence) REFERENCES Competence(id_competence)
-    );""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS Ennemi (
+    );""",
+        """CREATE TABLE IF NOT EXISTS Ennemi (
         id_ennemi INTEGER PRIMARY KEY,
         nom TEXT,
         pv INTEGER,
         attaque INTEGER,
         type TEXT
-    );""")
+    );""",
+    ],
+    # 2 : plusieurs héros par base, rangés par compte, avec les index des recherches courantes
+    [
+        "ALTER TABLE Joueur ADD COLUMN compte TEXT NOT NULL DEFAULT 'local'",
+        # recherche d'un héros par compte et nom
+        "CREATE INDEX IF NOT EXISTS idx_joueur_compte_nom ON Joueur (compte, nom)",
+        # liste des héros d'un compte page par page (l'index contient aussi id_joueur)
+        "CREATE INDEX IF NOT EXISTS idx_joueur_compte ON Joueur (compte)",
+        # classement niveau / XP lu uniquement dans l'index, sans toucher à la table
+        "CREATE INDEX IF NOT EXISTS idx_joueur_classement ON Joueur (niveau, exp, id_joueur, nom, id_classe)",
+    ],
+    # 3 : journal des combats, une ligne par tour (on ne fait qu'y ajouter des lignes)
+    [
+        """CREATE TABLE IF NOT EXISTS CombatLog (
+        id_log INTEGER PRIMARY KEY,
+        id_joueur INTEGER,
+        id_ennemi INTEGER,
+        tour INTEGER,
+        choix TEXT,
+        degats_infliges INTEGER,
+        degats_subis INTEGER,     -- négatif si le joueur s'est soigné
+        pv_joueur INTEGER,
+        pv_ennemi INTEGER,
+        issue TEXT                -- 'victoire', 'defaite' ou NULL si le combat continue
+    );""",
+    ],
+    # 4 : classements tenus à jour par des triggers.
+    # Chaque table Classement* compte les héros par valeur de clé : le rang d'un héros est
+    # la somme des comptes au-dessus de lui. Le coût dépend du nombre de valeurs de clé
+    # différentes au-dessus du héros (pas du nombre de héros) ; exp n'ayant pas de
+    # limite, le tableau 'niveau' est complété par la migration 6.
+    [
+        "ALTER TABLE Joueur ADD COLUMN boss_vaincus INTEGER NOT NULL DEFAULT 0",
+        # moins de tours de combat pour finir l'aventure (NULL tant qu'elle n'est pas finie)
+        "ALTER TABLE Joueur ADD COLUMN meilleur_tours INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_joueur_boss ON Joueur (boss_vaincus, niveau, id_joueur, nom, id_classe)",
+        """CREATE INDEX IF NOT EXISTS idx_joueur_rapide ON Joueur (meilleur_tours, id_joueur, nom, id_classe)
+           WHERE meilleur_tours IS NOT NULL""",
+        "CREATE TABLE IF NOT EXISTS ClassementNiveau (niveau INTEGER, exp INTEGER, nb INTEGER, PRIMARY KEY (niveau, exp)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS ClassementBoss (boss_vaincus INTEGER, niveau INTEGER, nb INTEGER, PRIMARY KEY (boss_vaincus, niveau)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS ClassementRapide (tours INTEGER PRIMARY KEY, nb INTEGER) WITHOUT ROWID",
+        """CREATE TABLE IF NOT EXISTS StatsClasse (
+        id_classe INTEGER PRIMARY KEY,
+        heros INTEGER,
+        somme_niveau INTEGER,
+        max_niveau INTEGER,
+        boss_vaincus INTEGER,
+        meilleur_tours INTEGER
+    );""",
+        # les héros déjà en base
+        "INSERT INTO ClassementNiveau SELECT niveau, exp, COUNT(*) FROM Joueur GROUP BY niveau, exp",
+        "INSERT INTO ClassementBoss SELECT boss_vaincus, niveau, COUNT(*) FROM Joueur GROUP BY boss_vaincus, niveau",
+        "INSERT INTO StatsClasse SELECT id_classe, COUNT(*), SUM(niveau), MAX(niveau), SUM(boss_vaincus), MIN(meilleur_tours) FROM Joueur GROUP BY id_classe",
+        """CREATE TRIGGER IF NOT EXISTS joueur_ajout AFTER INSERT ON Joueur BEGIN
+        INSERT INTO ClassementNiveau VALUES (NEW.niveau, NEW.exp, 1)
+            ON CONFLICT (niveau, exp) DO UPDATE SET nb = nb + 1;
+        INSERT INTO ClassementBoss VALUES (NEW.boss_vaincus, NEW.niveau, 1)
+            ON CONFLICT (boss_vaincus, niveau) DO UPDATE SET nb = nb + 1;
+        INSERT INTO ClassementRapide SELECT NEW.meilleur_tours, 1 WHERE NEW.meilleur_tours IS NOT NULL
+            ON CONFLICT (tours) DO UPDATE SET nb = nb + 1;
+        INSERT INTO StatsClasse VALUES (NEW.id_classe, 1, NEW.niveau, NEW.niveau, NEW.boss_vaincus, NEW.meilleur_tours)
+            ON CONFLICT (id_classe) DO UPDATE SET heros = heros + 1, somme_niveau = somme_niveau + NEW.niveau,
+                max_niveau = MAX(max_niveau, NEW.niveau), boss_vaincus = boss_vaincus + NEW.boss_vaincus,
+                meilleur_tours = COALESCE(MIN(meilleur_tours, NEW.meilleur_tours), meilleur_tours, NEW.meilleur_tours);
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_suppression AFTER DELETE ON Joueur BEGIN
+        UPDATE ClassementNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau AND exp = OLD.exp;
+        UPDATE ClassementBoss SET nb = nb - 1 WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau;
+        UPDATE ClassementRapide SET nb = nb - 1 WHERE tours = OLD.meilleur_tours;
+        -- un maximum ou un minimum qui part doit être recalculé (rare)
+        UPDATE StatsClasse SET heros = heros - 1, somme_niveau = somme_niveau - OLD.niveau,
+            boss_vaincus = boss_vaincus - OLD.boss_vaincus,
+            max_niveau = (SELECT MAX(niveau) FROM Joueur WHERE id_classe = OLD.id_classe),
+            meilleur_tours = (SELECT MIN(meilleur_tours) FROM Joueur WHERE id_classe = OLD.id_classe)
+            WHERE id_classe = OLD.id_classe;
+    END""",
+        # PlayerStore réécrit toutes les colonnes : on ne fait rien si les clés n'ont pas bougé
+        """CREATE TRIGGER IF NOT EXISTS joueur_niveau AFTER UPDATE OF niveau, exp ON Joueur
+        WHEN OLD.niveau IS NOT NEW.niveau OR OLD.exp IS NOT NEW.exp BEGIN
+        UPDATE ClassementNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau AND exp = OLD.exp;
+        INSERT INTO ClassementNiveau VALUES (NEW.niveau, NEW.exp, 1)
+            ON CONFLICT (niveau, exp) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_boss AFTER UPDATE OF boss_vaincus, niveau ON Joueur
+        WHEN OLD.boss_vaincus IS NOT NEW.boss_vaincus OR OLD.niveau IS NOT NEW.niveau BEGIN
+        UPDATE ClassementBoss SET nb = nb - 1 WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau;
+        INSERT INTO ClassementBoss VALUES (NEW.boss_vaincus, NEW.niveau, 1)
+            ON CONFLICT (boss_vaincus, niveau) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_rapide AFTER UPDATE OF meilleur_tours ON Joueur
+        WHEN OLD.meilleur_tours IS NOT NEW.meilleur_tours BEGIN
+        UPDATE ClassementRapide SET nb = nb - 1 WHERE tours = OLD.meilleur_tours;
+        INSERT INTO ClassementRapide SELECT NEW.meilleur_tours, 1 WHERE NEW.meilleur_tours IS NOT NULL
+            ON CONFLICT (tours) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_classe AFTER UPDATE OF niveau, boss_vaincus, meilleur_tours ON Joueur
+        WHEN OLD.niveau IS NOT NEW.niveau OR OLD.boss_vaincus IS NOT NEW.boss_vaincus
+             OR OLD.meilleur_tours IS NOT NEW.meilleur_tours BEGIN
+        -- le maximum (ou minimum) n'est recalculé que si c'était ce héros et qu'il recule
+        UPDATE StatsClasse SET somme_niveau = somme_niveau - OLD.niveau + NEW.niveau,
+            max_niveau = CASE
+                WHEN NEW.niveau >= max_niveau THEN NEW.niveau
+                WHEN OLD.niveau < max_niveau THEN max_niveau
+                ELSE (SELECT MAX(niveau) FROM Joueur WHERE id_classe = NEW.id_classe) END,
+            boss_vaincus = boss_vaincus - OLD.boss_vaincus + NEW.boss_vaincus,
+            meilleur_tours = CASE
+                WHEN NEW.meilleur_tours IS NOT NULL AND (meilleur_tours IS NULL OR NEW.meilleur_tours <= meilleur_tours)
+                    THEN NEW.meilleur_tours
+                WHEN OLD.meilleur_tours IS NULL OR OLD.meilleur_tours > meilleur_tours THEN meilleur_tours
+                ELSE (SELECT MIN(meilleur_tours) FROM Joueur WHERE id_classe = NEW.id_classe) END
+            WHERE id_classe = NEW.id_classe;
+    END""",
+    ],
+    # 5 : classes, compétences et ennemis sont lus dans CONTENT, plus dans la base
+    # (les clés étrangères de Joueur ne sont pas activées, elles restent sans effet)
+    [
+        "DROP TABLE IF EXISTS Classe",
+        "DROP TABLE IF EXISTS Competence",
+        "DROP TABLE IF EXISTS Ennemi",
+    ],
+    # 6 : nombre de héros par niveau seul. Le rang 'niveau' additionne les niveaux au-dessus
+    # (quelques centaines de lignes) puis, dans ClassementNiveau, seulement les valeurs
+    # d'exp du niveau du héros, au lieu de tous les couples (niveau, exp) au-dessus de lui.
+    [
+        "CREATE TABLE IF NOT EXISTS ClassementParNiveau (niveau INTEGER PRIMARY KEY, nb INTEGER) WITHOUT ROWID",
+        "INSERT INTO ClassementParNiveau SELECT niveau, COUNT(*) FROM Joueur GROUP BY niveau",
+        """CREATE TRIGGER IF NOT EXISTS joueur_ajout_niveau AFTER INSERT ON Joueur BEGIN
+        INSERT INTO ClassementParNiveau VALUES (NEW.niveau, 1)
+            ON CONFLICT (niveau) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_suppression_niveau AFTER DELETE ON Joueur BEGIN
+        UPDATE ClassementParNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau;
+    END""",
+        """CREATE TRIGGER IF NOT EXISTS joueur_niveau_seul AFTER UPDATE OF niveau ON Joueur
+        WHEN OLD.niveau IS NOT NEW.niveau BEGIN
+        UPDATE ClassementParNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau;
+        INSERT INTO ClassementParNiveau VALUES (NEW.niveau, 1)
+            ON CONFLICT (niveau) DO UPDATE SET nb = nb + 1;
+    END""",
+    ],
+    # 7 : une clé qui n'a plus de héros est supprimée au lieu de rester à nb = 0
+    # (sinon chaque calcul de rang parcourt aussi ces lignes mortes)
+    [
+        "DELETE FROM ClassementNiveau WHERE nb = 0",
+        "DELETE FROM ClassementBoss WHERE nb = 0",
+        "DELETE FROM ClassementRapide WHERE nb = 0",
+        "DELETE FROM ClassementParNiveau WHERE nb = 0",
+        "DROP TRIGGER IF EXISTS joueur_suppression",
+        "DROP TRIGGER IF EXISTS joueur_niveau",
+        "DROP TRIGGER IF EXISTS joueur_boss",
+        "DROP TRIGGER IF EXISTS joueur_rapide",
+        "DROP TRIGGER IF EXISTS joueur_suppression_niveau",
+        "DROP TRIGGER IF EXISTS joueur_niveau_seul",
+        """CREATE TRIGGER joueur_suppression AFTER DELETE ON Joueur BEGIN
+        UPDATE ClassementNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau AND exp = OLD.exp;
+        DELETE FROM ClassementNiveau WHERE niveau = OLD.niveau AND exp = OLD.exp AND nb = 0;
+        UPDATE ClassementBoss SET nb = nb - 1 WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau;
+        DELETE FROM ClassementBoss WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau AND nb = 0;
+        UPDATE ClassementRapide SET nb = nb - 1 WHERE tours = OLD.meilleur_tours;
+        DELETE FROM ClassementRapide WHERE tours = OLD.meilleur_tours AND nb = 0;
+        -- un maximum ou un minimum qui part doit être recalculé (rare)
+        UPDATE StatsClasse SET heros = heros - 1, somme_niveau = somme_niveau - OLD.niveau,
+            boss_vaincus = boss_vaincus - OLD.boss_vaincus,
+            max_niveau = (SELECT MAX(niveau) FROM Joueur WHERE id_classe = OLD.id_classe),
+            meilleur_tours = (SELECT MIN(meilleur_tours) FROM Joueur WHERE id_classe = OLD.id_classe)
+            WHERE id_classe = OLD.id_classe;
+    END""",
+        """CREATE TRIGGER joueur_niveau AFTER UPDATE OF niveau, exp ON Joueur
+        WHEN OLD.niveau IS NOT NEW.niveau OR OLD.exp IS NOT NEW.exp BEGIN
+        UPDATE ClassementNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau AND exp = OLD.exp;
+        DELETE FROM ClassementNiveau WHERE niveau = OLD.niveau AND exp = OLD.exp AND nb = 0;
+        INSERT INTO ClassementNiveau VALUES (NEW.niveau, NEW.exp, 1)
+            ON CONFLICT (niveau, exp) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER joueur_boss AFTER UPDATE OF boss_vaincus, niveau ON Joueur
+        WHEN OLD.boss_vaincus IS NOT NEW.boss_vaincus OR OLD.niveau IS NOT NEW.niveau BEGIN
+        UPDATE ClassementBoss SET nb = nb - 1 WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau;
+        DELETE FROM ClassementBoss WHERE boss_vaincus = OLD.boss_vaincus AND niveau = OLD.niveau AND nb = 0;
+        INSERT INTO ClassementBoss VALUES (NEW.boss_vaincus, NEW.niveau, 1)
+            ON CONFLICT (boss_vaincus, niveau) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER joueur_rapide AFTER UPDATE OF meilleur_tours ON Joueur
+        WHEN OLD.meilleur_tours IS NOT NEW.meilleur_tours BEGIN
+        UPDATE ClassementRapide SET nb = nb - 1 WHERE tours = OLD.meilleur_tours;
+        DELETE FROM ClassementRapide WHERE tours = OLD.meilleur_tours AND nb = 0;
+        INSERT INTO ClassementRapide SELECT NEW.meilleur_tours, 1 WHERE NEW.meilleur_tours IS NOT NULL
+            ON CONFLICT (tours) DO UPDATE SET nb = nb + 1;
+    END""",
+        """CREATE TRIGGER joueur_suppression_niveau AFTER DELETE ON Joueur BEGIN
+        UPDATE ClassementParNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau;
+        DELETE FROM ClassementParNiveau WHERE niveau = OLD.niveau AND nb = 0;
+    END""",
+        """CREATE TRIGGER joueur_niveau_seul AFTER UPDATE OF niveau ON Joueur
+        WHEN OLD.niveau IS NOT NEW.niveau BEGIN
+        UPDATE ClassementParNiveau SET nb = nb - 1 WHERE niveau = OLD.niveau;
+        DELETE FROM ClassementParNiveau WHERE niveau = OLD.niveau AND nb = 0;
+        INSERT INTO ClassementParNiveau VALUES (NEW.niveau, 1)
+            ON CONFLICT (niveau) DO UPDATE SET nb = nb + 1;
+    END""",
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
 
-    conn.commit()
+# ce que contient la table Version d'une base à jour
+EXPECTED_VERSIONS = {'schema': str(SCHEMA_VERSION)}
 
-    # On insere les données dans la base
-    cur.execute("SELECT COUNT(*) FROM Classe")
-    if cur.fetchone()[0] == 0:
-        cur.executemany("INSERT INTO Classe (id_classe, nom, pv_base, attaque_base, nom_competence, effet) VALUES (?, ?, ?, ?, ?, ?)",
-                       [
-                           (1, 'Sorcier', 12, 10, "Gèle l'ennemi", "0 dégats de l'ennemi pendant 1 tour"),
-                           (2, 'Archer', 10, 9, 'Flèche explosive', "Prochaine attaque inflige +50% dégâts"),
-                           (3, 'Chevalier', 16, 14, 'Bouclier divin', "Réduit de 70% les dégâts reçus pendant 2 tours"),
-                           (4, 'Barbare', 14, 12, 'Fureur d\'Odin', "Augmente de 50% les dégâts pendant 2 tours"),
-                           (5, 'Assassin', 10, 12, 'Esquive ultime', "Vous subissez 0 dégât pendant ce tour"),
-                           (6, 'Artificier',13,15,"Explosives Artisanaux","Fait une explosion qui inflige 250 degat"),
-                           (7, 'Bard',12,8,"Musique Etourdissante", "Etourdi l'ennemi pendant 3 tours"),
-                           (8, 'Moine',13,15,'Fureur des Moines','Assene 3 coup violent pendant 1 tours'),
-                           (9, 'Nécromancien',12,10,"Drain Vital","infligez 100% de dégats et soignez vous de 50%" ),
-                           (10,'Bouffon du Roi', 12, 12,"Chaos du Bouffon","Une action aleatoire s'active")
-                       ])
-    cur.execute("SELECT COUNT(*) FROM Competence")
-    if cur.fetchone()[0] == 0:
-        cur.executemany("""INSERT INTO Competence
-            (id_competence, id_classe, nom, effet, bonus_pv, bonus_attaque, duree_tours)
-            VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            [
-                (1, 1, 'Gel', "0 dégats de l'ennemi pendant 1 tour", 0, 0, 1),
-                (2, 2, 'Flèche explosive', "Prochaine attaque inflige +50% dégâts", 0, 0, 1),
-                (3, 3, 'Bouclier divin', "Réduit de 70% les dégâts reçus pendant 2 tours", 0, 0, 2),
-                (4, 4, 'Fureur d\'Odin', "Augmente de 50% les dégâts pendant 2 tours", 0, 0, 2),
-                (5, 5, 'Esquive ultime', "Vous subissez 0 dégât pendant ce tour", 0, 0, 1),
-                (6, 6,'Explosives Artisanaux', "Fait une explosion qui inflige 25O degats",0,0,1),
-                (7, 7,'Musique Etourdissante',"Etourdit l'ennemi pendant 3 tours", 0, 0, 3),
-                (8,8,'Fureur des Moines','Assene 3 coup violent pendant 1 tours',0,3,1),
-                (9,9,'Drain Vital','infligez 100% de dégats et soignez vous de 50%',0,0,1),
-                (10,10,'Chaos du bouffon',"Une cation aleatoire s'active",0,0,1)
-            ])
-
-    cur.execute("SELECT COUNT(*) FROM Ennemi")
-    if cur.fetchone()[0] == 0:
-        cur.executemany("INSERT INTO Ennemi (id_ennemi, nom, pv, attaque, type) VALUES (?, ?, ?, ?, ?)",
-                       [
-                           (1, 'Zombie', 10, 4, 'basique'),
-                           (2, 'Squelette', 8, 3, 'basique'),
-                           (3,'Groupe de pillard',15,5,'basique'),
-                           (4,'Goblin', 4, 3,'basique'),
-                           (5,'Rat',1,2,'basique'),
-                           (12, 'Lothric, Prince cadet et Lorian, Prince aîné', 125, 10, 'boss'),
-                           (11, 'Yhorm le Géant', 75, 7, 'boss'),
-                           (10, "Jack Chistophe, Prêtre de l'Evangile de l'Eglise Ulmer Münster", 50, 4, 'boss'),
-                           (14, 'Le Roi sans Nom',150,15,'boss'),
-                           (13,"Ilyan, L'indompteur sanguinaire de la Tricky Tower de Dieuv",150,17,'boss')
-                       ])
+def read_versions(cur):
+    try:
+        cur.execute(QUERIES['versions'])
+    except sqlite3.OperationalError:
+        return {}  # base vide ou d'avant la table Version
+    return dict(cur.fetchall())
 
-    conn.commit()
+def init_db(path=DB, db=None):
+    """
+    Connexion prête à jouer (schéma à jour) et son curseur.
+    db: Database déjà ouverte à utiliser à la place de path.
+    Une base ':memory:' est copiée depuis memory_template() : rien n'est écrit sur le disque.
+    """
+    if db is None:
+        db = open_database(path)
+    # connexion du thread courant, déjà réglée (voir Database)
+    conn = db.connection()
+    cur = conn.cursor()
+    if db.path == ":memory:":
+        memory_template().backup(conn)
+    else:
+        setup_db(conn, cur)
     return conn, cur
 
+# base ':memory:' migrée une fois par processus, recopiée par init_db
+_memory_template = None
+
+def memory_template():
+    global _memory_template
+    if _memory_template is None:
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        setup_db(conn, conn.cursor())
+        _memory_template = conn
+    return _memory_template
+
+def setup_db(conn, cur):
+    """Applique les migrations qui manquent à la base."""
+    # une seule requête si la base est déjà à jour
+    versions = read_versions(cur)
+    if versions == EXPECTED_VERSIONS:
+        return
+
+    if conn.in_transaction:
+        conn.commit()
+    # Chaque migration et la mise à jour de Version forment une seule transaction
+    # (sqlite3 validerait sinon chaque ALTER TABLE tout de suite) : une mise à jour
+    # interrompue ne laisse pas de migration à moitié appliquée. BEGIN IMMEDIATE
+    # prend le verrou d'écriture, et la version est relue une fois le verrou obtenu
+    # au cas où une autre session aurait migré la base entre-temps.
+    for numero, migration in enumerate(MIGRATIONS, 1):
+        if numero <= int(versions.get('schema', 0)):
+            continue
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("CREATE TABLE IF NOT EXISTS Version (cle TEXT PRIMARY KEY, valeur TEXT)")
+            versions = read_versions(cur)
+            if numero > int(versions.get('schema', 0)):
+                for sql in migration:
+                    cur.execute(sql)
+                cur.execute("INSERT OR REPLACE INTO Version (cle, valeur) VALUES ('schema', ?)", (str(numero),))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    # empreintes des anciennes tables de contenu (avant la migration 5)
+    cur.execute("DELETE FROM Version WHERE cle <> 'schema'")
+    conn.commit()
+
 # -----------------------------------------
 # Fonctions utiles pour la base de donnée
 # -----------------------------------------
+# classes, compétences et ennemis viennent de CONTENT : cur n'est gardé que pour
+# ne pas changer l'appel de ces fonctions
 def fetch_classes(cur):
-    cur.execute("SELECT id_classe, nom, pv_base, attaque_base FROM Classe")
-    return cur.fetchall()
+    return [c[:4] for c in CONTENT.classes]
 
 def fetch_classes_with_competence(cur):
-    cur.execute("""
-        SELECT
-            Classe.id_classe,
-            Classe.nom,
-            Classe.pv_base,
-            Classe.attaque_base,
-            Competence.nom,
-            Competence.effet
-        FROM Classe
-        JOIN Competence ON Classe.id_classe = Competence.id_classe
-        ORDER BY Classe.id_classe
-    """)
-    return cur.fetchall()
+    return [c[:4] + (CONTENT.skill_by_class[c.id_classe].nom, CONTENT.skill_by_class[c.id_classe].effet)
+            for c in CONTENT.classes if c.id_classe in CONTENT.skill_by_class]
 
 
 def fetch_comp_for_class(cur, id_classe):
-    cur.execute("SELECT id_competence, nom, effet, bonus_pv, bonus_attaque, duree_tours FROM Competence WHERE id_classe = ?", (id_classe,))
-    return cur.fetchone()
+    skill = CONTENT.skill_by_class.get(id_classe)
+    return (skill.id_competence,) + skill[2:] if skill else None
 
-def create_player(cur, conn, nom, id_classe):
+# compte des héros créés depuis le terminal
+DEFAULT_ACCOUNT = "local"
+
+def create_player(cur, conn, nom, id_classe, compte=DEFAULT_ACCOUNT):
     comp = fetch_comp_for_class(cur, id_classe)
-    cur.execute("SELECT pv_base, attaque_base FROM Classe WHERE id_classe = ?", (id_classe,))
-    pv_base, atk_base = cur.fetchone()
+    classe = CONTENT.classes_by_id[id_classe]
+    pv_base, atk_base = classe.pv_base, classe.attaque_base
     attaque = atk_base + (comp[4] if comp else 0)
     pv_total = pv_base + (comp[3] if comp else 0)
-    cur.execute("""INSERT INTO Joueur (nom, id_classe, id_competence, exp, pv, attaque, niveau)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""", (nom, id_classe, comp[0] if comp else None, 0, pv_total, attaque, 1))
+    cur.execute(QUERIES['nouveau_joueur'], (nom, id_classe, comp[0] if comp else None, 0, pv_total, attaque, 1, compte))
     conn.commit()
+    return cur.lastrowid
+
+def get_player(cur, id_joueur=None):
+    if id_joueur is not None:
+        cur.execute(QUERIES['joueur'], (id_joueur,))
+    else:
+        cur.execute(QUERIES['dernier_joueur'])
+    return _with_class_name(cur.fetchone())
+
+def _with_class_name(row):
+    """Ajoute le nom de la classe en 9e colonne (None si le héros ou sa classe n'existe pas)."""
+    if row is None or row[2] not in CONTENT.classes_by_id:
+        return None
+    return row[:8] + (CONTENT.classes_by_id[row[2]].nom,) + row[8:]
+
+def find_player(cur, compte, nom):
+    """Le héros nommé nom du compte (le plus récent s'il y en a plusieurs), mêmes colonnes que get_player."""
+    cur.execute(QUERIES['joueur_compte_nom'], (compte, nom))
+    return _with_class_name(cur.fetchone())
+
+def list_players(cur, compte=DEFAULT_ACCOUNT, after=0, limit=20):
+    """
+    Une page de héros du compte : (id_joueur, nom, id_classe, niveau, exp).
+    Pour la page suivante, after = id_joueur de la dernière ligne.
+    """
+    cur.execute(QUERIES['joueurs_compte'], (compte, after, limit))
+    return cur.fetchall()
+
+def top_players(cur, limit=10, after=None):
+    """
+    Classement par niveau puis XP : (id_joueur, nom, id_classe, niveau, exp).
+    Pour la page suivante, after = (niveau, exp, id_joueur) de la dernière ligne.
+    """
+    if after is None:
+        cur.execute(QUERIES['classement'], (limit,))
+    else:
+        cur.execute(QUERIES['classement_suite'], (*after, limit))
+    return cur.fetchall()
+
+# classements : tableau -> (requête du top, requête du rang, clés du héros pour le rang)
+LEADERBOARDS = {
+    'niveau': ('classement', 'rang_niveau', lambda cles: (cles[0], cles[1])),
+    'boss': ('classement_boss', 'rang_boss', lambda cles: (cles[2], cles[0])),
+    'rapide': ('classement_rapide', 'rang_rapide', lambda cles: (cles[3],)),
+}
+
+def leaderboard(cur, tableau='niveau', limit=10):
+    """Les limit premiers du tableau 'niveau', 'boss' ou 'rapide' (lus dans l'index du tableau)."""
+    cur.execute(QUERIES[LEADERBOARDS[tableau][0]], (limit,))
+    return cur.fetchall()
+
+def player_rank(cur, id_joueur, tableau='niveau'):
+    """Rang du héros dans le tableau, None s'il n'y figure pas (ex. aventure jamais finie pour 'rapide')."""
+    cur.execute(QUERIES['cles_classement'], (id_joueur,))
+    cles = cur.fetchone()
+    if cles is None:
+        return None
+    params = LEADERBOARDS[tableau][2](cles)
+    if None in params:
+        return None
+    cur.execute(QUERIES[LEADERBOARDS[tableau][1]], params)
+    return cur.fetchone()[0]
 
-def get_player(cur):
-    cur.execute("""SELECT id_joueur, Joueur.nom, Joueur.id_classe, Joueur.id_competence,
-                          Joueur.exp, Joueur.pv, Joueur.attaque, Joueur.niveau, Classe.nom
-                   FROM Joueur JOIN Classe ON Joueur.id_classe = Classe.id_classe
-                   ORDER BY id_joueur DESC LIMIT 1""")
-    return cur.fetchone()
-
-def update_player_stats(cur, conn, id_joueur, pv=None, exp=None, attaque=None, niveau=None):
-    q = "UPDATE Joueur SET "
-    updates = []
-    params = []
-    if pv is not None:
-        updates.append("pv = ?"); params.append(pv)
-    if exp is not None:
-        updates.append("exp = ?"); params.append(exp)
-    if attaque is not None:
-        updates.append("attaque = ?"); params.append(attaque)
-    if niveau is not None:
-        updates.append("niveau = ?"); params.append(niveau)
-    q += ", ".join(updates) + " WHERE id_joueur = ?"
-    params.append(id_joueur)
-    cur.execute(q, tuple(params))
+def class_stats(cur):
+    """(classe, héros, niveau moyen, niveau max, boss vaincus, meilleur nombre de tours) par classe."""
+    cur.execute(QUERIES['stats_classes'])
+    return [(CONTENT.classes_by_id[row[0]].nom,) + row[1:] for row in cur.fetchall()
+            if row[0] in CONTENT.classes_by_id]
+
+def update_player_stats(cur, conn, id_joueur, pv=None, exp=None, attaque=None, niveau=None,
+                        boss_vaincus=None, meilleur_tours=None):
+    # les classements suivent tout seuls (triggers de la migration 4)
+    cur.execute(QUERIES['maj_joueur'], (pv, exp, attaque, niveau, boss_vaincus, meilleur_tours, id_joueur))
     conn.commit()
 
+# Points intermédiaires où PlayerStore écrit dans la base par défaut :
+# fin d'une étape de l'aventure, boss vaincu. La fin de l'aventure (ou la sortie
+# du jeu) écrit toujours, quel que soit flush_on (voir adventure_machine).
+FLUSH_CHECKPOINTS = ('etape', 'boss')
+
+def player_update_params(id_joueur, fields):
+    """Paramètres de QUERIES['maj_joueur'] pour les champs modifiés (les autres restent à None)."""
+    return (fields.get('pv'), fields.get('exp'), fields.get('attaque'), fields.get('niveau'),
+            fields.get('boss_vaincus'), fields.get('meilleur_tours'), id_joueur)
+
+class PlayerStore:
+    """
+    Ecriture différée des stats du joueur : update() garde les champs modifiés
+    en mémoire (le dernier gagne) et flush() les écrit tous en une seule
+    transaction. checkpoint(nom) ne fait un flush que si nom est dans flush_on ;
+    flush() à la fin de la partie n'est pas optionnel.
+    """
+    def __init__(self, cur, conn, flush_on=FLUSH_CHECKPOINTS):
+        self.cur = cur
+        self.conn = conn
+        self.flush_on = set(flush_on)
+        # {id_joueur: {champ: valeur}} en attente d'écriture
+        self.dirty = {}
+
+    def update(self, id_joueur, pv=None, exp=None, attaque=None, niveau=None, boss_vaincus=None, meilleur_tours=None):
+        fields = self.dirty.setdefault(id_joueur, {})
+        for name, value in (('pv', pv), ('exp', exp), ('attaque', attaque), ('niveau', niveau),
+                            ('boss_vaincus', boss_vaincus), ('meilleur_tours', meilleur_tours)):
+            if value is not None:
+                fields[name] = value
+
+    def checkpoint(self, name):
+        if name in self.flush_on:
+            self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.cur.executemany(QUERIES['maj_joueur'], [player_update_params(id_joueur, fields)
+                                                     for id_joueur, fields in self.dirty.items()])
+        self.conn.commit()
+        self.dirty.clear()
+
+def fetch_enemies(cur):
+    return list(CONTENT.enemies)
+
 def fetch_enemy_by_name(cur, name):
-    cur.execute("SELECT id_ennemi, nom, pv, attaque, type FROM Ennemi WHERE nom = ?", (name,))
-    return cur.fetchone()
+    return CONTENT.enemies_by_name.get(name)
+
+# modèle d'ennemi partagé par toutes ses instances (mêmes champs que la table Ennemi,
+# plus la clé de son dessin dans ENEMY_LOGOS, ou None)
+EnemyTemplate = collections.namedtuple('EnemyTemplate', 'id nom pv attaque type art')
+
+def enemy_template(base_enemy):
+    """Modèle à partir d'une ligne (id, nom, pv, attaque, type) de la table Ennemi."""
+    if isinstance(base_enemy, EnemyTemplate):
+        return base_enemy
+    id, nom, pv, attaque, type = base_enemy[:5]
+    return EnemyTemplate(id, nom, pv, attaque, type, nom if nom in ENEMY_LOGOS else None)
+
+class Enemy:
+    """
+    Un ennemi prêt à combattre : seuls pv et attaque lui sont propres,
+    le reste est lu dans son modèle (partagé, jamais modifié).
+    """
+    __slots__ = ('template', 'pv', 'attaque')
+
+    def __init__(self, template, pv, attaque):
+        self.template = template
+        self.pv = pv
+        self.attaque = attaque
+
+    @property
+    def id(self):
+        return self.template.id
+
+    @property
+    def nom(self):
+        return self.template.nom
+
+    @property
+    def type(self):
+        return self.template.type
+
+    @property
+    def art(self):
+        return self.template.art
+
+# (pv de base, attaque de base, scale) -> (pv, attaque) : l'arrondi n'est calculé qu'une fois
+_scaled_stats = {}
+
+def scaled_stats(template, scale):
+    key = (template.pv, template.attaque, scale)
+    stats = _scaled_stats.get(key)
+    if stats is None:
+        stats = _scaled_stats[key] = (int(math.ceil(template.pv * scale)),
+                                      int(max(1, math.ceil(template.attaque * scale))))
+    return stats
+
+class EnemyPool:
+    """Instances d'Enemy rendues après un combat, réutilisées au lieu d'en allouer de nouvelles."""
+    def __init__(self):
+        self.free = []
+
+    def acquire(self, template, pv, attaque):
+        if self.free:
+            enemy = self.free.pop()
+            enemy.template, enemy.pv, enemy.attaque = template, pv, attaque
+            return enemy
+        return Enemy(template, pv, attaque)
+
+    def release(self, enemy):
+        self.free.append(enemy)
+
+ENEMY_POOL = EnemyPool()
 
 # crée une instance de l'enemie
-def new_enemy_instance(base_enemy, scale=1.0):
-    # table_enemi: (id, nom, pv, attaque, type)
-    return {
-        'id': base_enemy[0],
-        'nom': base_enemy[1],
-        'pv': int(math.ceil(base_enemy[2] * scale)),
-        'attaque': int(max(1, math.ceil(base_enemy[3] * scale))),
-        'type': base_enemy[4]
-    }
+def new_enemy_instance(base_enemy, scale=1.0, pool=None):
+    # base_enemy: EnemyTemplate ou ligne (id, nom, pv, attaque, type)
+    if base_enemy.__class__ is not EnemyTemplate:
+        base_enemy = enemy_template(base_enemy)
+    # appelé des millions de fois en simulation : on lit la table directement
+    stats = _scaled_stats.get((base_enemy[2], base_enemy[3], scale)) or scaled_stats(base_enemy, scale)
+    if pool is not None:
+        return pool.acquire(base_enemy, *stats)
+    return Enemy(base_enemy, *stats)
+
+# ---------------------------
+# Catalogue des ennemis
+# ---------------------------
+# Les ennemis de CONTENT indexés une fois : faire apparaître un ennemi coûte une
+# recherche dans un dict, pas une requête SQL.
+
+# paliers de difficulté selon la menace (pv * attaque) : palier 0 sous 50, 1 sous 500...
+ENEMY_TIERS = (50, 500, 1500)
+
+def enemy_tier(base_enemy):
+    menace = base_enemy[2] * base_enemy[3]
+    return sum(menace >= seuil for seuil in ENEMY_TIERS)
+
+class EnemyCatalog:
+    """Tous les ennemis, indexés par id, nom, type et palier de difficulté."""
+    def __init__(self, rows):
+        # un EnemyTemplate par ligne, triés par id
+        self.rows = tuple(enemy_template(row) for row in rows)
+        self.by_id = {e[0]: e for e in self.rows}
+        self.by_name = {e[1]: e for e in self.rows}
+        self.by_type = collections.defaultdict(list)
+        self.by_tier = collections.defaultdict(list)
+        for e in self.rows:
+            self.by_type[e[4]].append(e)
+            self.by_tier[enemy_tier(e)].append(e)
+        # stats de chaque ennemi déjà arrondies pour toutes les étapes de l'aventure
+        for e in self.rows:
+            for scale in adventure_scales():
+                scaled_stats(e, scale)
+
+    def of_type(self, type):
+        return self.by_type.get(type, [])
+
+    def of_tier(self, tier):
+        return self.by_tier.get(tier, [])
+
+_enemy_catalog = None
+
+def enemy_catalog(cur=None):
+    """Catalogue construit à la première demande (le contenu ne change pas pendant le jeu)."""
+    global _enemy_catalog
+    if _enemy_catalog is None:
+        _enemy_catalog = EnemyCatalog(CONTENT.enemies)
+    return _enemy_catalog
 
 # ---------------------------
 # ASCII arts des ennemis
@@ -1522,190 +2248,1385 @@ _..--'.-(    |   `-'''-'   |    )-.`--.._
 """,
 }
 
+# ---------------------------
+# Contenu figé (classes, compétences, ennemis)
+# ---------------------------
+# Ces lignes ne changent jamais pendant le jeu : elles sont compilées une fois au
+# chargement en tuples et dicts en lecture seule, et lues sans passer par SQLite.
+# La base ne garde plus que les données des joueurs.
+
+STATIC_CONTENT = {
+    'Classe': [
+        (1, 'Sorcier', 12, 10, "Gèle l'ennemi", "0 dégats de l'ennemi pendant 1 tour"),
+        (2, 'Archer', 10, 9, 'Flèche explosive', "Prochaine attaque inflige +50% dégâts"),
+        (3, 'Chevalier', 16, 14, 'Bouclier divin', "Réduit de 70% les dégâts reçus pendant 2 tours"),
+        (4, 'Barbare', 14, 12, 'Fureur d\'Odin', "Augmente de 50% les dégâts pendant 2 tours"),
+        (5, 'Assassin', 10, 12, 'Esquive ultime', "Vous subissez 0 dégât pendant ce tour"),
+        (6, 'Artificier',13,15,"Explosives Artisanaux","Fait une explosion qui inflige 250 degat"),
+        (7, 'Bard',12,8,"Musique Etourdissante", "Etourdi l'ennemi pendant 3 tours"),
+        (8, 'Moine',13,15,'Fureur des Moines','Assene 3 coup violent pendant 1 tours'),
+        (9, 'Nécromancien',12,10,"Drain Vital","infligez 100% de dégats et soignez vous de 50%" ),
+        (10,'Bouffon du Roi', 12, 12,"Chaos du Bouffon","Une action aleatoire s'active")
+    ],
+    'Competence': [
+        (1, 1, 'Gel', "0 dégats de l'ennemi pendant 1 tour", 0, 0, 1),
+        (2, 2, 'Flèche explosive', "Prochaine attaque inflige +50% dégâts", 0, 0, 1),
+        (3, 3, 'Bouclier divin', "Réduit de 70% les dégâts reçus pendant 2 tours", 0, 0, 2),
+        (4, 4, 'Fureur d\'Odin', "Augmente de 50% les dégâts pendant 2 tours", 0, 0, 2),
+        (5, 5, 'Esquive ultime', "Vous subissez 0 dégât pendant ce tour", 0, 0, 1),
+        (6, 6,'Explosives Artisanaux', "Fait une explosion qui inflige 25O degats",0,0,1),
+        (7, 7,'Musique Etourdissante',"Etourdit l'ennemi pendant 3 tours", 0, 0, 3),
+        (8,8,'Fureur des Moines','Assene 3 coup violent pendant 1 tours',0,3,1),
+        (9,9,'Drain Vital','infligez 100% de dégats et soignez vous de 50%',0,0,1),
+        (10,10,'Chaos du bouffon',"Une cation aleatoire s'active",0,0,1)
+    ],
+    'Ennemi': [
+        (1, 'Zombie', 10, 4, 'basique'),
+        (2, 'Squelette', 8, 3, 'basique'),
+        (3,'Groupe de pillard',15,5,'basique'),
+        (4,'Goblin', 4, 3,'basique'),
+        (5,'Rat',1,2,'basique'),
+        (12, 'Lothric, Prince cadet et Lorian, Prince aîné', 125, 10, 'boss'),
+        (11, 'Yhorm le Géant', 75, 7, 'boss'),
+        (10, "Jack Chistophe, Prêtre de l'Evangile de l'Eglise Ulmer Münster", 50, 4, 'boss'),
+        (14, 'Le Roi sans Nom',150,15,'boss'),
+        (13,"Ilyan, L'indompteur sanguinaire de la Tricky Tower de Dieuv",150,17,'boss')
+    ],
+}
+
+ClassRow = collections.namedtuple('ClassRow', 'id_classe nom pv_base attaque_base nom_competence effet')
+SkillRow = collections.namedtuple('SkillRow', 'id_competence id_classe nom effet bonus_pv bonus_attaque duree_tours')
+
+class ContentBundle:
+    """STATIC_CONTENT trié par id et indexé, en lecture seule (tuples et MappingProxyType)."""
+    __slots__ = ('classes', 'classes_by_id', 'skills', 'skill_by_class', 'enemies', 'enemies_by_name')
+
+    def __init__(self, content):
+        self.classes = tuple(sorted(ClassRow(*row) for row in content['Classe']))
+        self.classes_by_id = types.MappingProxyType({c.id_classe: c for c in self.classes})
+        self.skills = tuple(sorted(SkillRow(*row) for row in content['Competence']))
+        skill_by_class = {}
+        for skill in self.skills:
+            # une compétence par classe, la première si jamais il y en a plusieurs
+            skill_by_class.setdefault(skill.id_classe, skill)
+        self.skill_by_class = types.MappingProxyType(skill_by_class)
+        self.enemies = tuple(sorted(enemy_template(row) for row in content['Ennemi']))
+        self.enemies_by_name = types.MappingProxyType({e.nom: e for e in self.enemies})
+
+CONTENT = ContentBundle(STATIC_CONTENT)
+
+# ---------------------------
+# Moteur de combat (sans affichage)
+# ---------------------------
+# Le moteur ne fait ni input(), ni print(), ni accès à la base de donnée :
+# on lui donne un état + une action, il rend le nouvel état + la liste des
+# événements du tour. L'affichage et la sauvegarde restent dans combat_turn_by_turn.
+
+# Texte affiché pour chaque événement renvoyé par resolve_turn
+EVENT_MESSAGES = {
+    'attaque': "> Vous attaquez et infligez {} dégâts.",
+    'attente': "> Vous attendez, vous prenez le prochain coup sans riposte.",
+    'competence_deja_utilisee': "> Compétence déjà utilisée ce combat ! Vous ratez votre action.",
+    'competence': "> Vous utilisez votre compétence : {} - {}",
+    'gel': "L'ennemi est gelé et ne pourra pas attaquer ce tour.",
+    'fleche': "Votre prochaine attaque infligera +50% dégâts.",
+    'bouclier': "Vous êtes protégé·e : -70% dégâts reçus pendant 2 tours.",
+    'fureur': "Vos dégâts augmentent de 50% pendant 2 tours.",
+    'esquive': "Vous esquivez tout : 0 dégât subi pour ce tour.",
+    'explosion': "BOOMMMM vous infligez 250 dégats !",
+    'musique': "L'ennemi est envouter par votre musique.",
+    'critique': "> Coup critique !",
+    'etourdi': "> L'ennemi est étourdi !",
+    'coup': "> Coup {} : {} dégâts",
+    'drain': "> Vous drainez {} PV à l'ennemi.",
+    'soin': "> Vous récupérez {} PV.",
+    'chaos_critique': ">  Coup critique ! {} dégâts !",
+    'chaos_rate': ">  Vous ratez complètement votre attaque...",
+    'chaos_blessure': ">  Oups ! Vous vous blessez : {} dégâts !",
+    'chaos_rire': ">  L'ennemi est mort de rire et ne peut pas attaquer !",
+    'competence_inconnue': "(Compétence inconnue : aucun effet appliqué.)",
+    'ennemi_gele': "> L'ennemi est gelé et ne peut pas attaquer.",
+    'ennemi_etourdi': "> L'ennemi est etourdit et ne peut pas attaquer.",
+    'invincible': "> Vous êtes invincible ce tour : vous ne subissez aucun dégât.",
+    'ennemi_attaque': "> L'ennemi attaque et vous inflige {} dégâts.",
+    # rencontres à plusieurs (Encounter)
+    'raid_attaque': "> {} attaque {} et inflige {} dégâts.",
+    'raid_attente': "> {} attend.",
+    'raid_rate': "> {} rate son action.",
+    'raid_competence': "> {} utilise {} sur {}.",
+    'raid_bloque': "> {} ne peut pas attaquer.",
+    'raid_ennemi_attaque': "> {} attaque {} et inflige {} dégâts.",
+    'raid_ko': "> {} est hors combat.",
+}
+
+def format_event(event):
+    """Transforme un événement (code, valeurs...) en texte à afficher."""
+    return EVENT_MESSAGES[event[0]].format(*event[1:])
+
+class Effects:
+    """Boosts et nerfs temporaires d'un combat (tous présents dès le début, pas de .get())."""
+    __slots__ = ('player_buff_atk', 'player_def_reduce_pct', 'player_def_reduce_turns',
+                 'enemy_frozen', 'enemy_stun', 'player_invincible', 'player_atk_mult')
+
+    def __init__(self):
+        self.player_buff_atk = 0
+        self.player_def_reduce_pct = 0
+        self.player_def_reduce_turns = 0
+        self.enemy_frozen = 0
+        self.enemy_stun = 0
+        self.player_invincible = 0
+        self.player_atk_mult = 1.0
+
+    def copy(self):
+        e = Effects.__new__(Effects)
+        e.player_buff_atk = self.player_buff_atk
+        e.player_def_reduce_pct = self.player_def_reduce_pct
+        e.player_def_reduce_turns = self.player_def_reduce_turns
+        e.enemy_frozen = self.enemy_frozen
+        e.enemy_stun = self.enemy_stun
+        e.player_invincible = self.player_invincible
+        e.player_atk_mult = self.player_atk_mult
+        return e
+
+    def astuple(self):
+        return (self.player_buff_atk, self.player_def_reduce_pct, self.player_def_reduce_turns,
+                self.enemy_frozen, self.enemy_stun, self.player_invincible, self.player_atk_mult)
+
+class CombatState:
+    """PV/ATK des deux combattants pendant un combat, plus les effets en cours."""
+    __slots__ = ('player_pv', 'player_atk', 'enemy_pv', 'enemy_atk', 'skill_used', 'turn', 'durations')
+
+    def copy(self):
+        s = CombatState.__new__(CombatState)
+        s.player_pv = self.player_pv
+        s.player_atk = self.player_atk
+        s.enemy_pv = self.enemy_pv
+        s.enemy_atk = self.enemy_atk
+        s.skill_used = self.skill_used
+        s.turn = self.turn
+        s.durations = self.durations.copy()
+        return s
+
+def new_combat_state(player, enemy):
+    """Etat de départ d'un combat à partir du dict player et de l'instance enemy."""
+    s = CombatState()
+    s.player_pv = player['pv']
+    s.player_atk = player['attaque']
+    s.enemy_pv = enemy.pv
+    s.enemy_atk = enemy.attaque
+    s.skill_used = False
+    s.turn = 1
+    # suit les boosts et les nerfs temporaire
+    s.durations = Effects()
+    return s
+
+def combat_outcome(state):
+    """'victoire', 'defaite' ou None si le combat continue."""
+    if state.enemy_pv <= 0:
+        return 'victoire'
+    if state.player_pv <= 0:
+        return 'defaite'
+    return None
+
+# Effet de chaque compétence, rangé par id_competence.
+# Une compétence reçoit l'état du combat (déjà copié par resolve_turn) et le modifie.
+# Pour une nouvelle compétence (DLC) il suffit d'ajouter sa fonction ici.
+
+def skill_gel(skill, s, durations, events, rng):
+    durations.enemy_frozen = skill.duree  #joueur gelé pendant 1 tour
+    events.append(('gel',))
+
+def skill_fleche(skill, s, durations, events, rng):
+    durations.player_atk_mult = 1.5  # la prochaine attaque inflige 150% de dégats supplémentaire
+    events.append(('fleche',))
+
+def skill_bouclier(skill, s, durations, events, rng):
+    durations.player_def_reduce_pct = 0.7  # reduit les degats subis de 70% pendant 2 tours
+    durations.player_def_reduce_turns = skill.duree
+    events.append(('bouclier',))
+
+def skill_fureur(skill, s, durations, events, rng):
+    durations.player_atk_mult = 1.5
+    durations.player_buff_atk = skill.duree
+    events.append(('fureur',))
+
+def skill_esquive(skill, s, durations, events, rng):
+    durations.player_invincible = skill.duree  # 1 turn
+    events.append(('esquive',))
+
+def skill_explosion(skill, s, durations, events, rng):
+    s.enemy_pv -= 250
+    events.append(('explosion',))
+
+def skill_musique(skill, s, durations, events, rng):
+    durations.enemy_stun = skill.duree  #joueur etourdit pendant 1 tour
+    events.append(('musique',))
+
+def skill_moines(skill, s, durations, events, rng):
+    total_dmg = 0
+    for i in range(3):
+        dmg = int(math.ceil(s.player_atk * 0.35))
+        # critique sur le 2e coup
+        if i == 1 and rng.random() < 0.3:
+            dmg *= 2
+            events.append(('critique',))
+        # stun sur le 3e
+        if i == 2 and rng.random() < 0.2:
+            durations.enemy_stun = 1
+            events.append(('etourdi',))
+        total_dmg += dmg
+        events.append(('coup', i+1, dmg))
+    s.enemy_pv -= total_dmg
+
+def skill_drain(skill, s, durations, events, rng):
+    dmg = int(math.ceil(s.player_atk))
+    heal = int(dmg * 0.5)
+    s.enemy_pv -= dmg
+    s.player_pv += heal
+    events.append(('drain', dmg))
+    events.append(('soin', heal))
+
+def skill_chaos(skill, s, durations, events, rng):
+    roll = rng.random()
+    if roll < 0.4:
+        dmg = int(math.ceil(s.player_atk * 2))
+        s.enemy_pv -= dmg
+        events.append(('chaos_critique', dmg))
+    elif roll < 0.7:
+        events.append(('chaos_rate',))
+    elif roll < 0.9:
+        dmg = int(math.ceil(s.player_atk))
+        s.player_pv -= dmg
+        events.append(('chaos_blessure', dmg))
+    else:
+        durations.enemy_stun = 1
+        events.append(('chaos_rire',))
+
+SKILL_HANDLERS = {
+    1: skill_gel,
+    2: skill_fleche,
+    3: skill_bouclier,
+    4: skill_fureur,
+    5: skill_esquive,
+    6: skill_explosion,
+    7: skill_musique,
+    8: skill_moines,
+    9: skill_drain,
+    10: skill_chaos,
+}
+
+# Pour chaque compétence aléatoire : les valeurs que doit renvoyer random()
+# pour tomber dans chaque cas, et la probabilité de ce cas
+# (utilisé par la simulation en masse et par le solveur exact)
+RANDOM_BRANCHES = {
+    8: [
+        ((0.0, 0.0), 0.3 * 0.2),  # critique + étourdi
+        ((0.0, 0.5), 0.3 * 0.8),  # critique
+        ((0.5, 0.0), 0.7 * 0.2),  # étourdi
+        ((0.5, 0.5), 0.7 * 0.8),  # rien de spécial
+    ],
+    10: [
+        ((0.0,), 0.4),   # coup critique
+        ((0.5,), 0.3),   # raté
+        ((0.8,), 0.2),   # blessure
+        ((0.95,), 0.1),  # fou rire
+    ],
+}
+
+class Skill:
+    """Une ligne de la table Competence avec son effet déjà résolu."""
+    def __init__(self, row, apply):
+        self.id, self.id_classe, self.nom, self.effet, self.bonus_pv, self.bonus_attaque, self.duree = row
+        self.apply = apply
+
+def load_skills(cur):
+    """
+    Charge toutes les compétences une seule fois : {id_competence: Skill}.
+    Une compétence sans effet dans SKILL_HANDLERS est une erreur (au lieu d'un combat sans effet).
+    """
+    skills = {}
+    for row in CONTENT.skills:
+        if row[0] not in SKILL_HANDLERS:
+            raise ValueError(f"Compétence {row[0]} ({row[2]}) sans effet dans SKILL_HANDLERS")
+        skills[row[0]] = Skill(row, SKILL_HANDLERS[row[0]])
+    return skills
+
+def skill_for_class(skills, id_classe):
+    """La compétence d'une classe (ou None)."""
+    for skill in skills.values():
+        if skill.id_classe == id_classe:
+            return skill
+    return None
+
+def resolve_turn(state, choix, skill, rng=random):
+    """
+    Joue un tour complet (action du joueur puis riposte de l'ennemi).
+    state: CombatState renvoyé par new_combat_state (il n'est pas modifié)
+    choix: '1' attaquer, '2' ne rien faire, '3' compétence
+    skill: Skill du joueur (voir load_skills), ou None
+    rng: source de hasard (le module random par défaut)
+    Renvoie (nouvel_etat, evenements).
+    """
+    s = state.copy()
+    durations = s.durations
+    events = []
+
+    # réalisation de l'action choisie par le joueur
+    if choix == '1':
+        # Prend en compte si le choix est attaquer lees degats du personnages et les possibles boosts
+        atk_multiplier = 1.0
+        if durations.player_atk_mult != 1.0:
+            atk_multiplier = durations.player_atk_mult
+        dmg = int(math.ceil(s.player_atk * atk_multiplier))
+        events.append(('attaque', dmg))
+        s.enemy_pv -= dmg
+    elif choix == '2':
+        events.append(('attente',))
+        # Prend en compte le choix de ne rien faire
+    else:  # Prend en compte le choix d'utiliser la compétence du personnage
+        if s.skill_used:
+            events.append(('competence_deja_utilisee',))
+        elif skill is None:
+            s.skill_used = True
+            events.append(('competence_inconnue',))
+        else:
+            s.skill_used = True
+            events.append(('competence', skill.nom, skill.effet))
+            # appleique la compétence relié au personnage dans la table Competence
+            skill.apply(skill, s, durations, events, rng)
+
+    # Si l'adversaire n'a plus de PV il ne riposte pas
+    if s.enemy_pv <= 0:
+        return s, events
+
+    # On regarde si l'enemi est gelé pendant son tour
+    if durations.enemy_frozen > 0:
+        events.append(('ennemi_gele',))
+        durations.enemy_frozen -= 0.5
+    elif durations.enemy_stun > 0:
+        events.append(('ennemi_etourdi',))
+        durations.enemy_stun -= 0.5
+    else:
+        # L'enemi attaque
+        dmg_received = s.enemy_atk
+        if durations.player_def_reduce_pct:
+            # si le joueur a activé sa compétence, on lui inflige seulement 30% de dégats
+            reduce_pct = durations.player_def_reduce_pct
+            dmg_received = int(math.ceil(dmg_received * (1 - reduce_pct)))
+        if durations.player_invincible > 0:
+            events.append(('invincible',))
+            dmg_received = 0
+
+        # Si le joueur a choisi de ne rien faire, on lui inflige juste les dégats normal du monstre dans la base de donnée
+        events.append(('ennemi_attaque', dmg_received))
+        s.player_pv -= dmg_received
+
+        # On fait en sorte que le compte des tours se fasse pour que les compétences s'arretent
+        if durations.player_buff_atk > 0:
+            durations.player_buff_atk -= 1
+            if durations.player_buff_atk == 0:
+                durations.player_atk_mult = 1.0
+        if durations.player_def_reduce_turns:
+            durations.player_def_reduce_turns -= 1
+            if durations.player_def_reduce_turns == 0:
+                durations.player_def_reduce_pct = 0
+        if durations.player_invincible > 0:
+            durations.player_invincible -= 0.5
+        if choix == '1' and durations.player_atk_mult != 1.0:
+            if durations.player_buff_atk == 0:
+                durations.player_atk_mult = 1.0
+
+    # sinon on passe au tour suivant
+    if s.player_pv > 0:
+        s.turn += 1
+    return s, events
+
 # ---------------------------
 # Combat tour par tour
 # ---------------------------
-def combat_turn_by_turn(cur, conn, player, enemy, comp_data):
+def combat_turn_by_turn(cur, conn, player, enemy, skill, session=None, store=None):
     """
     player: dict with fields id_joueur, nom, id_classe, id_competence, exp, pv, attaque, niveau
-    enemy: dict with fields nom, pv, attaque, type
-    comp_data: (id_comp, nom, effet, bonus_pv, bonus_atk, duree)
+    enemy: Enemy with fields nom, pv, attaque, type
+    skill: Skill of the player (see load_skills)
+    session: Session (random + recorded answers), a new one if None
+    store: PlayerStore that keeps the new stats; without one they are written right away
     """
-    print("\n--- COMBAT : {} (PV {}) vs {} (PV {}) ---".format(player['nom'], player['pv'], enemy['nom'], enemy['pv']))
-    if enemy['nom'] in ENEMY_LOGOS:
-        print_ascii(ENEMY_LOGOS[enemy['nom']])
-    # suit les boosts et les nerfs temporaire
-    player_atk = player['attaque']
-    player_pv = player['pv']
-    enemy_pv = enemy['pv']
-    enemy_atk = enemy['attaque']
+    if session is None:
+        session = Session()
+    if store is None:
+        store = PlayerStore(cur, conn)
+        try:
+            return run_machine(combat_machine(player, enemy, skill, session, store), session)
+        finally:
+            store.flush()
+            session.output.flush()
+    try:
+        return run_machine(combat_machine(player, enemy, skill, session, store), session)
+    finally:
+        session.output.flush()
 
-    # utilisation de la compétence une fois par combat
-    skill_used = False
-    durations = {'player_buff_atk':0, 'player_def_reduce_pct':0, 'enemy_frozen':0, 'player_invincible':0, 'player_atk_mult':1.0}
+def combat_machine(player, enemy, skill, session, store):
+    """Le combat sous forme de générateur : yield un Prompt par tour, renvoie True si gagné."""
+    out = session.output
+    if out.level >= VERBOSITY_STEPS:
+        out.line("\n--- COMBAT : {} (PV {}) vs {} (PV {}) ---".format(player['nom'], player['pv'], enemy.nom, enemy.pv))
+    if enemy.art is not None and out.level >= VERBOSITY_TURNS:
+        out.art(ENEMY_LOGOS[enemy.art])
 
-    class_id = player['id_classe']
+    state = new_combat_state(player, enemy)
+    journal = session.telemetry
+    while combat_outcome(state) is None:
+        if out.level >= VERBOSITY_TURNS:
+            out.line(f"\n-- Tour {state.turn} --")
+            out.line(f"Votre PV : {state.player_pv} | Attaque : {state.player_atk} | Ennemi ({enemy.nom}) PV : {state.enemy_pv} | Ennemi ATK : {state.enemy_atk}")
+            # choix du joueur dans le combat
+            out.line("Choix : 1) Attaquer  2) Ne rien faire (prendre les dégats)  3) Utiliser compétence (1x/combat)")
+        prompt = combat_prompt(state, skill)
+        # l'image du tour est écrite d'un coup avant la question
+        out.flush()
+        choix = yield prompt
+        session.record(prompt, choix)
 
-    if comp_data:
-        comp_name = comp_data[1]
-    else:
-        comp_name = None
+        avant = state
+        state, events = resolve_turn(state, choix, skill, session.rng)
+        if out.level >= VERBOSITY_TURNS:
+            for event in events:
+                out.line(format_event(event))
+        if journal is not None:
+            journal.record((player.get('id_joueur'), enemy.id, avant.turn, choix,
+                            avant.enemy_pv - state.enemy_pv, avant.player_pv - state.player_pv,
+                            state.player_pv, state.enemy_pv, combat_outcome(state)))
+
+    # resolve_turn n'avance pas le compteur au dernier tour : turn = nombre de tours joués
+    if 'tours' in player:
+        player['tours'] += state.turn
+    # On regarde si l'adversaire a encore des PV apres l'action du joueur
+    if combat_outcome(state) == 'victoire':
+        # Ici on gagne de l'XP
+        xp_gain = 14 if enemy.type=='basique' else 70
+        if out.level >= VERBOSITY_STEPS:
+            out.line(f" Vous avez vaincu {enemy.nom} !")
+            out.line(f"Vous gagnez {xp_gain} EXP !")
+        player['exp'] += xp_gain
+        # On update la base de donnée pour changer le LVL et les PV du joueur en fonction de son LVL
+        player['pv'] = max(0, state.player_pv)
+        store.update(player['id_joueur'], pv=player['pv'], exp=player['exp'])
+        return True
+
+    # O regarde si le joueur est mort, si oui on envoie un message de fin.
+    if out.level >= VERBOSITY_STEPS:
+        out.line("💀 Vous êtes tombé·e au combat...")
+    player['pv'] = 0
+    store.update(player['id_joueur'], pv=player['pv'], exp=player['exp'])
+    return False
+
+# ---------------------------
+# Simulation en masse (NumPy)
+# ---------------------------
+# Mêmes règles que resolve_turn mais sur N combats à la fois : chaque
+# variable du combat devient un tableau avec une case par état de combat.
+
+def policy_attack(turn, etat):
+    """Attaque à chaque tour."""
+    return 1
+
+def policy_skill_first(turn, etat):
+    """Compétence au premier tour puis attaque."""
+    return 3 if turn == 1 else 1
+
+def _split_rows(etat, mask, probs, rng):
+    """
+    Découpe chaque ligne sélectionnée par mask en len(probs) lignes, une par
+    résultat possible du tirage, avec un effectif tiré selon une loi multinomiale.
+    Renvoie le nouvel etat et l'indice du résultat de chaque ligne (-1 si pas de tirage).
+    """
+    idx = np.flatnonzero(mask)
+    reste = np.flatnonzero(~mask)
+    tirages = rng.multinomial(etat['count'][idx], probs)
+    k = len(probs)
+    lignes = np.concatenate([reste, np.repeat(idx, k)])
+    nouveau = {cle: v[lignes] for cle, v in etat.items()}
+    nouveau['count'][len(reste):] = tirages.reshape(-1)
+    outcome = np.concatenate([np.full(len(reste), -1), np.tile(np.arange(k), len(idx))])
+    garde = nouveau['count'] > 0
+    return {cle: v[garde] for cle, v in nouveau.items()}, outcome[garde]
+
+# Version "tableaux" des compétences, rangée par id_competence comme SKILL_HANDLERS.
+# d: etat du lot, comp: lignes qui utilisent la compétence ce tour,
+# outcome: indice de la branche de RANDOM_BRANCHES tirée pour chaque ligne (-1 sinon).
+
+def batch_gel(skill, d, comp, outcome, player_atk):
+    d['enemy_frozen'][comp] = skill.duree
+
+def batch_fleche(skill, d, comp, outcome, player_atk):
+    d['player_atk_mult'][comp] = 1.5
+
+def batch_bouclier(skill, d, comp, outcome, player_atk):
+    d['player_def_reduce_pct'][comp] = 0.7
+    d['player_def_reduce_turns'][comp] = skill.duree
+
+def batch_fureur(skill, d, comp, outcome, player_atk):
+    d['player_atk_mult'][comp] = 1.5
+    d['player_buff_atk'][comp] = skill.duree
+
+def batch_esquive(skill, d, comp, outcome, player_atk):
+    d['player_invincible'][comp] = skill.duree
+
+def batch_explosion(skill, d, comp, outcome, player_atk):
+    d['enemy_pv'][comp] -= 250
+
+def batch_musique(skill, d, comp, outcome, player_atk):
+    d['enemy_stun'][comp] = skill.duree
+
+def batch_moines(skill, d, comp, outcome, player_atk):
+    coup = int(math.ceil(player_atk * 0.35))
+    d['enemy_pv'][comp] -= coup * 3
+    d['enemy_pv'][(outcome == 0) | (outcome == 1)] -= coup
+    d['enemy_stun'][(outcome == 0) | (outcome == 2)] = 1
+
+def batch_drain(skill, d, comp, outcome, player_atk):
+    coup = int(math.ceil(player_atk))
+    d['enemy_pv'][comp] -= coup
+    d['player_pv'][comp] += int(coup * 0.5)
+
+def batch_chaos(skill, d, comp, outcome, player_atk):
+    d['enemy_pv'][outcome == 0] -= int(math.ceil(player_atk * 2))
+    d['player_pv'][outcome == 2] -= int(math.ceil(player_atk))
+    d['enemy_stun'][outcome == 3] = 1
+
+BATCH_SKILL_HANDLERS = {
+    1: batch_gel,
+    2: batch_fleche,
+    3: batch_bouclier,
+    4: batch_fureur,
+    5: batch_esquive,
+    6: batch_explosion,
+    7: batch_musique,
+    8: batch_moines,
+    9: batch_drain,
+    10: batch_chaos,
+}
+
+def simulate_batch(player_pv, player_atk, skill, enemy_pv, enemy_atk, n, policy=policy_skill_first, rng=None, max_turns=1000):
+    """
+    Joue n combats identiques (même classe, même ennemi) en parallèle.
+    Les combats qui sont dans le même état ne prennent qu'une ligne avec un effectif
+    ('count') : un tirage aléatoire découpe la ligne selon une loi multinomiale, ce qui
+    donne le même résultat que n tirages séparés. 1 million de combats ne coûte donc
+    pas plus cher que quelques-uns.
+    policy(turn, etat) renvoie 1, 2 ou 3 (ou un tableau de choix, un par ligne encore en cours).
+    Renvoie un dict : victoires, defaites, tours (total des tours joués), pv_restants (total sur les victoires).
+    """
+    if np is None:
+        raise RuntimeError("NumPy est nécessaire pour la simulation en masse (pip install numpy).")
+    if rng is None:
+        rng = np.random.default_rng()
+    # une ligne par état de combat encore en cours
+    etat = {
+        'count': np.array([n], dtype=np.int64),
+        'player_pv': np.array([player_pv], dtype=np.int64),
+        'enemy_pv': np.array([enemy_pv], dtype=np.int64),
+        'skill_used': np.zeros(1, dtype=bool),
+        'player_atk_mult': np.ones(1),
+        'player_buff_atk': np.zeros(1, dtype=np.int64),
+        'player_def_reduce_pct': np.zeros(1),
+        'player_def_reduce_turns': np.zeros(1, dtype=np.int64),
+        'enemy_frozen': np.zeros(1),
+        'enemy_stun': np.zeros(1),
+        'player_invincible': np.zeros(1),
+    }
+    resultat = {'victoires': 0, 'defaites': 0, 'tours': 0, 'pv_restants': 0}
 
     turn = 1
-    while player_pv > 0 and enemy_pv > 0:
-        print(f"\n-- Tour {turn} --")
-        print(f"Votre PV : {player_pv} | Attaque : {player_atk} | Ennemi ({enemy['nom']}) PV : {enemy_pv} | Ennemi ATK : {enemy_atk}")
-        # choix du joueur dans le combat
-        print("Choix : 1) Attaquer  2) Ne rien faire (prendre les dégats)  3) Utiliser compétence (1x/combat)")
-        choix = input("Votre action (1/2/3) : ").strip()
-        while choix not in ('1','2','3'):
-            choix = input("Choix invalide, entrez 1, 2 ou 3 : ").strip()
-
-        # réalisation de l'action choisie par le joueur
+    while turn <= max_turns and len(etat['count']):
+        etat['choix'] = np.broadcast_to(np.asarray(policy(turn, etat)), etat['count'].shape).copy()
+
+        # les compétences aléatoires découpent les lignes avant d'être appliquées
+        comp = (etat['choix'] == 3) & ~etat['skill_used']
+        outcome = np.full(len(comp), -1)
+        if comp.any() and skill is not None and skill.id in RANDOM_BRANCHES:
+            etat, outcome = _split_rows(etat, comp, [p for _, p in RANDOM_BRANCHES[skill.id]], rng)
+
+        d = etat
+        choix = d.pop('choix')
+        enemy = d['enemy_pv']
+        player = d['player_pv']
+
+        # action du joueur : attaque
+        attaque = choix == 1
+        dmg = np.ceil(player_atk * d['player_atk_mult']).astype(np.int64)
+        enemy -= np.where(attaque, dmg, 0)
+
+        # action du joueur : compétence (une seule fois par combat)
+        comp = (choix == 3) & ~d['skill_used']
+        d['skill_used'] |= comp
+        if comp.any() and skill is not None:
+            BATCH_SKILL_HANDLERS[skill.id](skill, d, comp, outcome, player_atk)
+
+        # riposte de l'ennemi pour ceux qui sont encore debout
+        vivant = enemy > 0
+        gele = vivant & (d['enemy_frozen'] > 0)
+        d['enemy_frozen'][gele] -= 0.5
+        etourdi = vivant & ~gele & (d['enemy_stun'] > 0)
+        d['enemy_stun'][etourdi] -= 0.5
+        frappe = vivant & ~gele & ~etourdi
+
+        dmg_received = np.where(d['player_def_reduce_pct'] != 0,
+                                np.ceil(enemy_atk * (1 - d['player_def_reduce_pct'])), enemy_atk).astype(np.int64)
+        dmg_received[d['player_invincible'] > 0] = 0
+        player -= np.where(frappe, dmg_received, 0)
+
+        buff = frappe & (d['player_buff_atk'] > 0)
+        d['player_buff_atk'][buff] -= 1
+        d['player_atk_mult'][buff & (d['player_buff_atk'] == 0)] = 1.0
+        bouclier = frappe & (d['player_def_reduce_turns'] != 0)
+        d['player_def_reduce_turns'][bouclier] -= 1
+        d['player_def_reduce_pct'][bouclier & (d['player_def_reduce_turns'] == 0)] = 0
+        d['player_invincible'][frappe & (d['player_invincible'] > 0)] -= 0.5
+        d['player_atk_mult'][frappe & attaque & (d['player_buff_atk'] == 0)] = 1.0
+
+        # on retire les combats terminés
+        gagne = ~vivant
+        perdu = vivant & (player <= 0)
+        fini = gagne | perdu
+        if fini.any():
+            count = d['count']
+            resultat['victoires'] += int(count[gagne].sum())
+            resultat['defaites'] += int(count[perdu].sum())
+            resultat['tours'] += turn * int(count[fini].sum())
+            resultat['pv_restants'] += int((np.maximum(player[gagne], 0) * count[gagne]).sum())
+            encore = ~fini
+            etat = {k: v[encore] for k, v in d.items()}
+        turn += 1
+    return resultat
+
+def adventure_scales(total_steps=50):
+    """Tous les coefficients utilisés par play_adventure pour new_enemy_instance."""
+    scales = {1.0 + (step / total_steps) * 0.5 for step in range(total_steps)}
+    scales |= {1.0 + (step / total_steps) * 1.2 for step in range(10, total_steps + 1, 10)}
+    return sorted(scales)
+
+def win_rate_matrix(cur, n=100000, policy=policy_skill_first, seed=None, scales=None):
+    """
+    Taux de victoire pour chaque (id_classe, id_ennemi, scale).
+    Les cases qui donnent exactement les mêmes stats d'ennemi ne sont simulées qu'une fois.
+    """
+    rng = np.random.default_rng(seed) if np is not None else None
+    if scales is None:
+        scales = adventure_scales()
+    enemies = enemy_catalog(cur).rows
+    skills = load_skills(cur)
+    matrix = {}
+    deja_fait = {}
+    for id_classe, nom, pv_base, atk_base in fetch_classes(cur):
+        skill = skill_for_class(skills, id_classe)
+        # mêmes stats de départ que create_player
+        pv = pv_base + (skill.bonus_pv if skill else 0)
+        atk = atk_base + (skill.bonus_attaque if skill else 0)
+        for base_enemy in enemies:
+            for scale in scales:
+                enemy = new_enemy_instance(base_enemy, scale=scale)
+                key = (id_classe, enemy.pv, enemy.attaque)
+                if key not in deja_fait:
+                    r = simulate_batch(pv, atk, skill, enemy.pv, enemy.attaque, n, policy=policy, rng=rng)
+                    deja_fait[key] = r['victoires'] / n
+                matrix[(id_classe, base_enemy[0], scale)] = deja_fait[key]
+    return matrix
+
+# ---------------------------
+# Rencontres à plusieurs (raids, hordes)
+# ---------------------------
+# N héros contre M ennemis avec les mêmes règles que resolve_turn. L'ordre de
+# jeu vient d'une file de priorité (heapq) sur l'initiative : chaque combattant
+# rejoue 100 / vitesse plus tard, et tous ceux qui ont la même initiative jouent
+# ensemble. Chaque camp a aussi un tas trié par PV pour trouver la cible la
+# plus faible en O(log n), même avec des centaines de combattants.
+
+class Fighter:
+    """Un combattant d'une rencontre (héros ou ennemi)."""
+    __slots__ = ('id', 'nom', 'camp', 'pv', 'attaque', 'vitesse', 'skill', 'skill_used', 'turn', 'effects')
+
+    def __init__(self, nom, camp, pv, attaque, skill=None, vitesse=10):
+        self.id = None
+        self.nom = nom
+        self.camp = camp
+        self.pv = pv
+        self.attaque = attaque
+        self.vitesse = vitesse
+        self.skill = skill
+        self.skill_used = False
+        self.turn = 0
+        self.effects = Effects()
+
+def hero_fighter(player, skill, vitesse=10):
+    """Fighter à partir du dict player de play_adventure."""
+    return Fighter(player['nom'], 'heros', player['pv'], player['attaque'], skill, vitesse)
+
+def enemy_fighter(enemy, vitesse=10):
+    """Fighter à partir d'une instance de new_enemy_instance."""
+    return Fighter(enemy.nom, 'ennemis', enemy.pv, enemy.attaque, None, vitesse)
+
+class Encounter:
+    """
+    Une rencontre N contre M.
+    policy(turn, hero) choisit l'action des héros (les policies de simulate_batch marchent).
+    """
+    def __init__(self, heroes, enemies, rng=random, policy=policy_skill_first):
+        self.fighters = list(heroes) + list(enemies)
+        self.rng = rng
+        self.policy = policy
+        self.time = 0.0
+        self.alive = {'heros': 0, 'ennemis': 0}
+        # (PV, id) de chaque combattant en vie ; les entrées périmées sont ignorées à la lecture
+        self._targets = {'heros': [], 'ennemis': []}
+        # (instant où il rejoue, héros avant ennemis, départage aléatoire, id)
+        self._queue = []
+        for i, f in enumerate(self.fighters):
+            f.id = i
+            self.alive[f.camp] += 1
+            self._targets[f.camp].append((f.pv, i))
+            self._queue.append((100 / f.vitesse, f.camp != 'heros', rng.random(), i))
+        for heap in self._targets.values():
+            heapq.heapify(heap)
+        heapq.heapify(self._queue)
+
+    def outcome(self):
+        """'victoire' (pour les héros), 'defaite' ou None si la rencontre continue."""
+        if self.alive['ennemis'] == 0:
+            return 'victoire'
+        if self.alive['heros'] == 0:
+            return 'defaite'
+        return None
+
+    def weakest(self, camp):
+        """Le combattant en vie du camp avec le moins de PV."""
+        heap = self._targets[camp]
+        while heap:
+            pv, i = heap[0]
+            f = self.fighters[i]
+            if f.pv > 0 and f.pv == pv:
+                return f
+            heapq.heappop(heap)
+        return None
+
+    def _set_pv(self, f, pv, events):
+        if f.pv <= 0:
+            return
+        f.pv = pv
+        if pv <= 0:
+            self.alive[f.camp] -= 1
+            events.append(('raid_ko', f.nom))
+        else:
+            heapq.heappush(self._targets[f.camp], (pv, f.id))
+
+    def _hero_action(self, hero, events):
+        hero.turn += 1
+        target = self.weakest('ennemis')
+        fx = hero.effects
+        choix = str(self.policy(hero.turn, hero))
         if choix == '1':
-            # Prend en compte si le choix est attaquer lees degats du personnages et les possibles boosts
-            atk_multiplier = 1.0
-            if durations['player_atk_mult'] != 1.0:
-                atk_multiplier = durations['player_atk_mult']
-            dmg = int(math.ceil(player_atk * atk_multiplier))
-            print(f"> Vous attaquez et infligez {dmg} dégâts.")
-            enemy_pv -= dmg
+            dmg = int(math.ceil(hero.attaque * fx.player_atk_mult))
+            events.append(('raid_attaque', hero.nom, target.nom, dmg))
+            # la flèche explosive ne vaut que pour une attaque
+            if fx.player_atk_mult != 1.0 and fx.player_buff_atk == 0:
+                fx.player_atk_mult = 1.0
+            self._set_pv(target, target.pv - dmg, events)
         elif choix == '2':
-            print("> Vous attendez, vous prenez le prochain coup sans riposte.")
-            # Prend en compte le choix de ne rien faire
-        else:  # Prend en compte le choix d'utiliser la compétence du personnage
-            if skill_used:
-                print("> Compétence déjà utilisée ce combat ! Vous ratez votre action.")
+            events.append(('raid_attente', hero.nom))
+        elif hero.skill_used or hero.skill is None:
+            events.append(('raid_rate', hero.nom))
+        else:
+            hero.skill_used = True
+            events.append(('raid_competence', hero.nom, hero.skill.nom, target.nom))
+            # la compétence travaille sur un CombatState héros contre cible,
+            # les effets qui touchent l'ennemi (gel, étourdi) sont ensuite rendus à la cible
+            s = CombatState.__new__(CombatState)
+            s.player_pv, s.player_atk = hero.pv, hero.attaque
+            s.enemy_pv, s.enemy_atk = target.pv, target.attaque
+            s.skill_used, s.turn, s.durations = True, hero.turn, fx
+            fx.enemy_frozen, fx.enemy_stun = target.effects.enemy_frozen, target.effects.enemy_stun
+            hero.skill.apply(hero.skill, s, fx, events, self.rng)
+            target.effects.enemy_frozen, target.effects.enemy_stun = fx.enemy_frozen, fx.enemy_stun
+            fx.enemy_frozen = fx.enemy_stun = 0
+            if s.enemy_pv != target.pv:
+                self._set_pv(target, s.enemy_pv, events)
+            if s.player_pv != hero.pv:
+                self._set_pv(hero, s.player_pv, events)
+
+    def _enemy_action(self, enemy, events):
+        fx = enemy.effects
+        if fx.enemy_frozen > 0:
+            events.append(('raid_bloque', enemy.nom))
+            fx.enemy_frozen -= 0.5
+            return
+        if fx.enemy_stun > 0:
+            events.append(('raid_bloque', enemy.nom))
+            fx.enemy_stun -= 0.5
+            return
+        target = self.weakest('heros')
+        durations = target.effects
+        dmg_received = enemy.attaque
+        if durations.player_def_reduce_pct:
+            dmg_received = int(math.ceil(dmg_received * (1 - durations.player_def_reduce_pct)))
+        if durations.player_invincible > 0:
+            dmg_received = 0
+        events.append(('raid_ennemi_attaque', enemy.nom, target.nom, dmg_received))
+        self._set_pv(target, target.pv - dmg_received, events)
+
+        # mêmes compteurs que dans resolve_turn : ils avancent quand le héros est attaqué
+        if durations.player_buff_atk > 0:
+            durations.player_buff_atk -= 1
+            if durations.player_buff_atk == 0:
+                durations.player_atk_mult = 1.0
+        if durations.player_def_reduce_turns:
+            durations.player_def_reduce_turns -= 1
+            if durations.player_def_reduce_turns == 0:
+                durations.player_def_reduce_pct = 0
+        if durations.player_invincible > 0:
+            durations.player_invincible -= 0.5
+
+    def step(self):
+        """Fait jouer tous les combattants qui ont la prochaine initiative. Renvoie les événements."""
+        events = []
+        queue = self._queue
+        self.time = queue[0][0]
+        batch = []
+        while queue and queue[0][0] == self.time:
+            batch.append(heapq.heappop(queue))
+        for _, _, _, i in batch:
+            f = self.fighters[i]
+            if f.pv <= 0 or self.outcome() is not None:
+                continue
+            if f.camp == 'heros':
+                self._hero_action(f, events)
             else:
-                skill_used = True
-                print(f"> Vous utilisez votre compétence : {comp_data[1]} - {comp_data[2]}")
-                # appleique la compétence relié au personnage dans la table Competence
-                if comp_name == 'Gel':
-                    durations['enemy_frozen'] = comp_data[5]  #joueur gelé pendant 1 tour
-                    print("L'ennemi est gelé et ne pourra pas attaquer ce tour.")
-                elif comp_name == 'Flèche explosive':
-                    durations['player_atk_mult'] = 1.5  # la prochaine attaque inflige 150% de dégats supplémentaire
-                    print("Votre prochaine attaque infligera +50% dégâts.")
-                elif comp_name == 'Bouclier divin':
-                    durations['player_def_reduce_pct'] = 0.7  # reduit les degats subis de 70% pendant 2 tours
-                    durations['player_def_reduce_turns'] = comp_data[5]
-                    print("Vous êtes protégé·e : -70% dégâts reçus pendant 2 tours.")
-                elif comp_name == 'Fureur d\'Odin':
-                    durations['player_atk_mult'] = 1.5
-                    durations['player_buff_atk'] = comp_data[5]
-                    print("Vos dégâts augmentent de 50% pendant 2 tours.")
-                elif comp_name == 'Esquive ultime':
-                    durations['player_invincible'] = comp_data[5]  # 1 turn
-                    print("Vous esquivez tout : 0 dégât subi pour ce tour.")
-                elif comp_name == 'Explosives Artisanaux':
-                    enemy_pv-=250
-                    print("BOOMMMM vous infligez 250 dégats !")
-                elif comp_name == 'Musique Etourdissante':
-                    durations['enemy_stun'] = comp_data[5]  #joueur etourdit pendant 1 tour
-                    print("L'ennemi est envouter par votre musique.")
-                elif comp_name == 'Fureur des Moines':
-                    total_dmg = 0
-                    for i in range(3):
-                        dmg = int(math.ceil(player_atk * 0.35))
-                        # critique sur le 2e coup
-                        if i == 1 and random.random() < 0.3:
-                            dmg *= 2
-                            print("> Coup critique !")
-                        # stun sur le 3e
-                        if i == 2 and random.random() < 0.2:
-                            durations['enemy_stun'] = 1
-                            print("> L'ennemi est étourdi !")
-                        total_dmg += dmg
-                        print(f"> Coup {i+1} : {dmg} dégâts")
-                    enemy_pv -= total_dmg
-                elif comp_name == 'Drain Vital':
-                    dmg = int(math.ceil(player_atk))
-                    heal = int(dmg * 0.5)
-                    enemy_pv -= dmg
-                    player_pv += heal
-                    print(f"> Vous drainez {dmg} PV à l'ennemi.")
-                    print(f"> Vous récupérez {heal} PV.")
-                elif comp_name=='Chaos du bouffon':
-                    roll = random.random()
-                    if roll < 0.4:
-                        dmg = int(math.ceil(player_atk * 2))
-                        enemy_pv -= dmg
-                        print(f">  Coup critique ! {dmg} dégâts !")
-                    elif roll < 0.7:
-                        print(">  Vous ratez complètement votre attaque...")
-                    elif roll < 0.9:
-                        dmg = int(math.ceil(player_atk))
-                        player_pv -= dmg
-                        print(f">  Oups ! Vous vous blessez : {dmg} dégâts !")
-                    else:
-                        durations['enemy_stun'] = 1
-                        print(">  L'ennemi est mort de rire et ne peut pas attaquer !")
-                else:
-                    print("(Compétence inconnue : aucun effet appliqué.)")
-                
-
-        # On regarde si l'adversaire a encore des PV apres l'action du joueur
-        if enemy_pv <= 0:
-            print(f" Vous avez vaincu {enemy['nom']} !")
-            # Ici on gagne de l'XP
-            xp_gain = 14 if enemy['type']=='basique' else 70
-            print(f"Vous gagnez {xp_gain} EXP !")
-            player['exp'] += xp_gain
-            # On update la base de donnée pour changer le LVL et les PV du joueur en fonction de son LVL
-            player['pv'] = max(0, player_pv)
-            update_player_stats(cur, conn, player['id_joueur'], pv=player['pv'], exp=player['exp'])
-            return True
+                self._enemy_action(f, events)
+            if f.pv > 0:
+                heapq.heappush(queue, (self.time + 100 / f.vitesse, f.camp != 'heros', self.rng.random(), i))
+        return events
+
+    def run(self, max_steps=1000000, events=None):
+        """Joue jusqu'à la fin. events: liste à compléter si on veut garder le détail."""
+        steps = 0
+        while self.outcome() is None and self._queue and steps < max_steps:
+            batch_events = self.step()
+            if events is not None:
+                events.extend(batch_events)
+            steps += 1
+        return self.outcome()
+
+# ---------------------------
+# Solveur exact (chaîne de Markov)
+# ---------------------------
+# Un combat n'a que quelques états possibles et le hasard ne vient que de
+# compétences avec un nombre fini de résultats. On peut donc calculer la
+# probabilité exacte de victoire au lieu de simuler.
+
+SOLVER_CACHE = "fantasy_solveur.json"
+
+# Identifiant stable (nom:version) des policies dont les résultats vont dans le cache.
+# Changer une policy = changer sa version. Une policy sans identifiant (lambda,
+# méthode d'une IA...) n'est jamais mise en cache : deux d'entre elles pourraient
+# sinon se voir rendre le résultat de l'autre.
+POLICY_IDS = {
+    policy_attack: 'attaque:1',
+    policy_skill_first: 'competence_1er_tour:1',
+}
+
+class ScriptedRandom:
+    """Remplace le module random : renvoie des valeurs choisies à l'avance."""
+    def __init__(self, values=()):
+        self.values = list(values)
+
+    def random(self):
+        if not self.values:
+            raise RuntimeError("Tirage aléatoire non prévu dans RANDOM_BRANCHES")
+        return self.values.pop(0)
+
+def state_key(state):
+    """Tuple qui identifie un état de combat (sert de clé dans la table de mémo)."""
+    return (state.player_pv, state.enemy_pv, state.skill_used, state.turn) + state.durations.astuple()
+
+def solve_combat(state, skill, policy=policy_skill_first, memo=None, max_turns=200):
+    """
+    Résout un combat de façon exacte par programmation dynamique.
+    policy(turn, state) renvoie 1, 2 ou 3 (les mêmes que pour simulate_batch).
+    Renvoie un dict : victoire (probabilité), tours (espérance du nombre de tours),
+    pv_restants (espérance des PV restants, 0 en cas de défaite).
+    """
+    if memo is None:
+        memo = {}
+    key = state_key(state)
+    if key in memo:
+        return memo[key]
+
+    outcome = combat_outcome(state)
+    if outcome is not None or state.turn > max_turns:
+        # le combat est fini (au-delà de max_turns on le compte comme perdu)
+        gagne = outcome == 'victoire'
+        result = {'victoire': 1.0 if gagne else 0.0, 'tours': 0.0,
+                  'pv_restants': float(max(state.player_pv, 0)) if gagne else 0.0}
+        memo[key] = result
+        return result
+
+    choix = str(policy(state.turn, state))
+    branches = [((), 1.0)]
+    if choix == '3' and not state.skill_used and skill is not None and skill.id in RANDOM_BRANCHES:
+        branches = RANDOM_BRANCHES[skill.id]
+
+    result = {'victoire': 0.0, 'tours': 1.0, 'pv_restants': 0.0}
+    for values, proba in branches:
+        suivant, _ = resolve_turn(state, choix, skill, ScriptedRandom(values))
+        r = solve_combat(suivant, skill, policy, memo, max_turns)
+        result['victoire'] += proba * r['victoire']
+        result['tours'] += proba * r['tours']
+        result['pv_restants'] += proba * r['pv_restants']
+    memo[key] = result
+    return result
+
+def load_solver_cache(path=SOLVER_CACHE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
 
-        # On regarde si l'enemi est gelé pendant son tour
-        if durations.get('enemy_frozen',0) > 0:
-            print("> L'ennemi est gelé et ne peut pas attaquer.")
-            durations['enemy_frozen'] -= 0.5
-        elif durations.get('enemy_stun',0) > 0:
-            print("> L'ennemi est etourdit et ne peut pas attaquer.")
-            durations['enemy_stun'] -= 0.5
+def save_solver_cache(cache, path=SOLVER_CACHE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+
+def solve_matchup(cur, id_classe, base_enemy, scale, policy=policy_skill_first, cache=None, skills=None,
+                  policy_id=None, max_turns=200):
+    """
+    Résultat exact pour (classe, ennemi, scale) avec un héros de niveau 1.
+    cache: dict chargé par load_solver_cache (il est complété si le cas est nouveau).
+    skills: dict renvoyé par load_skills (rechargé si absent).
+    policy_id: identifiant stable de policy pour le cache (par défaut celui de POLICY_IDS) ;
+    sans identifiant le cache n'est pas utilisé.
+    """
+    if skills is None:
+        skills = load_skills(cur)
+    skill = skill_for_class(skills, id_classe)
+    classe = CONTENT.classes_by_id[id_classe]
+    pv_base, atk_base = classe.pv_base, classe.attaque_base
+    # mêmes stats de départ que create_player
+    player = {'pv': pv_base + (skill.bonus_pv if skill else 0), 'attaque': atk_base + (skill.bonus_attaque if skill else 0)}
+    enemy = new_enemy_instance(base_enemy, scale=scale)
+
+    # la clé ne dépend que de ce qui change le combat, donc un changement de stats invalide le cache
+    skill_key = (skill.id, skill.duree) if skill else None
+    if policy_id is None:
+        policy_id = POLICY_IDS.get(policy)
+    if policy_id is None:
+        cache = None
+    key = "|".join(str(v) for v in (skill_key, player['pv'], player['attaque'], enemy.pv, enemy.attaque,
+                                    policy_id, max_turns))
+    if cache is not None and key in cache:
+        return cache[key]
+    result = solve_combat(new_combat_state(player, enemy), skill, policy, max_turns=max_turns)
+    if cache is not None:
+        cache[key] = result
+    return result
+
+def solve_matrix(cur, policy=policy_skill_first, scales=None, path=SOLVER_CACHE, policy_id=None, max_turns=200):
+    """Comme win_rate_matrix mais exact, avec le cache sur disque (voir solve_matchup pour policy_id)."""
+    if scales is None:
+        scales = adventure_scales()
+    cache = load_solver_cache(path)
+    taille = len(cache)
+    matrix = {}
+    enemies = enemy_catalog(cur).rows
+    skills = load_skills(cur)
+    for id_classe, *_ in fetch_classes(cur):
+        for base_enemy in enemies:
+            for scale in scales:
+                matrix[(id_classe, base_enemy[0], scale)] = solve_matchup(
+                    cur, id_classe, base_enemy, scale, policy, cache, skills,
+                    policy_id=policy_id, max_turns=max_turns)
+    if len(cache) != taille:
+        save_solver_cache(cache, path)
+    return matrix
+
+# ---------------------------
+# IA de combat (expectimax)
+# ---------------------------
+# Choisit 1, 2 ou 3 pour le joueur : noeuds max sur le choix, noeuds de hasard
+# sur les compétences aléatoires (RANDOM_BRANCHES). Les positions déjà évaluées
+# vont dans une table de transposition qui sert pour tous les combats du même
+# matchup (même compétence, même attaque du héros et de l'ennemi).
+
+class _SearchTimeout(Exception):
+    pass
+
+# L'attaque du héros change à chaque niveau : sur un long lot les matchups et leurs
+# tables s'accumuleraient sans fin. Au-delà de AI_POSITIONS positions gardées en tout,
+# on oublie les matchups utilisés le moins récemment.
+AI_POSITIONS = 50000
+
+class ExpectimaxAI:
+    """
+    Recherche pour un matchup, avec sa profondeur et son budget de temps.
+    ExpectimaxAI.for_matchup partage la table de transposition entre toutes les
+    recherches du même matchup, quelles que soient leur profondeur et leur budget.
+    """
+    # {(id_competence, attaque héros, attaque ennemi): table}, du moins au plus récent
+    tables = collections.OrderedDict()
+    # positions dans toutes les tables de tables
+    positions = 0
+
+    def __init__(self, skill, depth=8, time_budget=None, matchup=None):
+        self.skill = skill
+        self.depth = depth
+        self.time_budget = time_budget
+        # clé de la table partagée (comptée dans AI_POSITIONS), None = table propre à l'instance
+        self.matchup = matchup
+        # {position: (profondeur, valeur, meilleur choix)}
+        self.table = self.table_for(matchup) if matchup is not None else {}
+        self._deadline = None
+
+    @classmethod
+    def for_matchup(cls, skill, state, depth=8, time_budget=None):
+        return cls(skill, depth, time_budget, (skill.id if skill else None, state.player_atk, state.enemy_atk))
+
+    @classmethod
+    def table_for(cls, matchup):
+        """Table partagée du matchup (une nouvelle s'il a été oublié), marquée comme la plus récente."""
+        table = cls.tables.get(matchup)
+        if table is None:
+            table = cls.tables[matchup] = {}
         else:
-            # L'enemi attaque
-            dmg_received = enemy_atk
-            if durations.get('player_def_reduce_pct',0):
-                # si le joueur a activé sa compétence, on lui inflige seulement 30% de dégats
-                reduce_pct = durations['player_def_reduce_pct']
-                dmg_received = int(math.ceil(dmg_received * (1 - reduce_pct)))
-            if durations.get('player_invincible',0) > 0:
-                print("> Vous êtes invincible ce tour : vous ne subissez aucun dégât.")
-                dmg_received = 0
-
-            # Si le joueur a choisi de ne rien faire, on lui inflige juste les dégats normal du monstre dans la base de donnée
-            print(f"> L'ennemi attaque et vous inflige {dmg_received} dégâts.")
-            player_pv -= dmg_received
-
-            # On fait en sorte que le compte des tours se fasse pour que les compétences s'arretent
-            if durations.get('player_buff_atk',0) > 0:
-                durations['player_buff_atk'] -= 1
-                if durations['player_buff_atk'] == 0:
-                    durations['player_atk_mult'] = 1.0
-            if durations.get('player_def_reduce_turns',0):
-                durations['player_def_reduce_turns'] -= 1
-                if durations['player_def_reduce_turns'] == 0:
-                    durations['player_def_reduce_pct'] = 0
-            if durations.get('player_invincible',0) > 0:
-                durations['player_invincible'] -= 0.5
-            if choix == '1' and durations.get('player_atk_mult',1.0) != 1.0:
-                if durations.get('player_buff_atk',0) == 0:
-                    durations['player_atk_mult'] = 1.0
-
-        # O regarde si le joueur est mort, si oui on envoie un message de fin.
-        if player_pv <= 0:
-            print("💀 Vous êtes tombé·e au combat...")
-            player['pv'] = 0
-            update_player_stats(cur, conn, player['id_joueur'], pv=player['pv'], exp=player['exp'])
-            return False
+            cls.tables.move_to_end(matchup)
+        return table
 
-        # sinon on continue
-        turn += 1
+    @classmethod
+    def shrink(cls, keep):
+        """Oublie les tables les moins récentes (sauf celle de keep) jusqu'à repasser sous AI_POSITIONS."""
+        while cls.positions > AI_POSITIONS and len(cls.tables) > 1:
+            matchup, table = cls.tables.popitem(last=False)
+            if matchup == keep:
+                cls.tables[matchup] = table
+                continue
+            cls.positions -= len(table)
+            # une recherche qui la garde encore n'y retrouvera plus rien et écrira dans une nouvelle
+            table.clear()
+        if cls.positions > AI_POSITIONS:
+            # un seul matchup plus gros que le budget : on repart d'une table vide
+            table = cls.tables[keep]
+            cls.positions -= len(table)
+            table.clear()
+
+    @staticmethod
+    def position(state):
+        # le numéro du tour ne change pas les règles : deux positions qui ne
+        # diffèrent que par le tour partagent la même entrée
+        return (state.player_pv, state.enemy_pv, state.skill_used) + state.durations.astuple()
 
-    player['pv'] = player_pv
-    update_player_stats(cur, conn, player['id_joueur'], pv=player['pv'], exp=player['exp'])
-    return player_pv > 0
+    @staticmethod
+    def heuristic(state):
+        """Estimation entre 0 et 1 : coups pour tuer l'ennemi contre coups pour mourir."""
+        to_kill = math.ceil(state.enemy_pv / max(1, state.player_atk))
+        to_die = math.ceil(state.player_pv / max(1, state.enemy_atk))
+        return to_die / (to_die + to_kill)
+
+    def value(self, state, depth):
+        outcome = combat_outcome(state)
+        if outcome == 'victoire':
+            # on préfère gagner avec plus de PV
+            return 1.0 + state.player_pv * 1e-4
+        if outcome == 'defaite':
+            return 0.0
+        if depth == 0:
+            return self.heuristic(state)
+        return self.best(state, depth)[0]
+
+    def best(self, state, depth):
+        """(valeur, choix) pour la position, avec la table de transposition."""
+        key = self.position(state)
+        entry = self.table.get(key)
+        if entry is not None and entry[0] >= depth:
+            return entry[1], entry[2]
+        if self._deadline is not None and timeit.default_timer() > self._deadline:
+            raise _SearchTimeout()
+
+        # '3' quand la compétence est déjà utilisée revient à attendre : on ne l'essaie pas
+        choices = ('1', '2') if state.skill_used else ('3', '1', '2')
+        best_value, best_choice = -1.0, '1'
+        for choix in choices:
+            branches = [((), 1.0)]
+            if choix == '3' and self.skill is not None and self.skill.id in RANDOM_BRANCHES:
+                branches = RANDOM_BRANCHES[self.skill.id]
+            v = 0.0
+            for values, proba in branches:
+                suivant, _ = resolve_turn(state, choix, self.skill, ScriptedRandom(values))
+                v += proba * self.value(suivant, depth - 1)
+            if v > best_value:
+                best_value, best_choice = v, choix
+        if self.matchup is None:
+            self.table[key] = (depth, best_value, best_choice)
+            return best_value, best_choice
+        # la table a pu être oubliée pendant la recherche : on écrit dans celle du matchup
+        table = self.table = ExpectimaxAI.table_for(self.matchup)
+        nouvelle = key not in table
+        table[key] = (depth, best_value, best_choice)
+        if nouvelle:
+            ExpectimaxAI.positions += 1
+            if ExpectimaxAI.positions > AI_POSITIONS:
+                ExpectimaxAI.shrink(self.matchup)
+        return best_value, best_choice
+
+    def choose(self, state):
+        """Choix '1', '2' ou '3' pour l'état, en approfondissant tant que le temps le permet."""
+        if self.time_budget is None:
+            return self.best(state, self.depth)[1]
+        self._deadline = timeit.default_timer() + self.time_budget
+        choix = '1'
+        try:
+            for depth in range(1, self.depth + 1):
+                choix = self.best(state, depth)[1]
+        except _SearchTimeout:
+            pass
+        finally:
+            self._deadline = None
+        return choix
+
+    def policy(self, turn, state):
+        """Même signature que les policies de simulate_batch / solve_combat."""
+        return int(self.choose(state))
+
+# ---------------------------
+# Parties sans joueur (lots en parallèle)
+# ---------------------------
+# Un fournisseur de décisions remplace le clavier : decide(kind, valid, context)
+# renvoie une des réponses de valid. kind vaut 'oui_non' (context = numéro d'étape)
+# ou 'combat' (context = (CombatState, Skill)).
+
+class ScriptedDecisions:
+    """Répond dans l'ordre avec une liste de réponses, en boucle ('o', '1', ...)."""
+    def __init__(self, answers=('o', '1')):
+        self.answers = list(answers)
+        self.i = 0
+
+    def __call__(self, kind, valid, context):
+        # on saute les réponses qui ne vont pas avec la question
+        for _ in range(len(self.answers)):
+            r = self.answers[self.i % len(self.answers)]
+            self.i += 1
+            if r in valid:
+                return r
+        return valid[0]
+
+class RandomDecisions:
+    """Répond au hasard."""
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+
+    def __call__(self, kind, valid, context):
+        return self.rng.choice(valid)
+
+class AIDecisions:
+    """Toujours 'o' aux questions, ExpectimaxAI en combat."""
+    def __init__(self, depth=8, time_budget=None):
+        self.depth = depth
+        self.time_budget = time_budget
+
+    def __call__(self, kind, valid, context):
+        if kind != 'combat':
+            return 'o' if 'o' in valid else valid[0]
+        state, skill = context
+        return ExpectimaxAI.for_matchup(skill, state, self.depth, self.time_budget).choose(state)
+
+DECISION_PROVIDERS = {
+    'script': ScriptedDecisions,
+    'hasard': RandomDecisions,
+    'ia': AIDecisions,
+}
+
+def decision_provider(provider, seed):
+    """
+    Fournisseur provider pour la partie de graine seed. Le hasard de 'hasard' est
+    tiré de la graine (dans un flux séparé de celui de la Session) : une même
+    graine donne la même partie.
+    """
+    if provider == 'hasard':
+        return RandomDecisions(random.Random(f"decisions-{seed}"))
+    return DECISION_PROVIDERS[provider]()
+
+# base en mémoire propre à chaque processus du lot (créée par _worker_init)
+_worker_db = None
+
+def _worker_init():
+    global _worker_db
+    _worker_db = init_db(":memory:")
+
+def run_headless_adventure(seed, id_classe, provider='ia'):
+    """
+    Joue une aventure complète sans terminal. Renvoie un petit résumé :
+    seed, classe, niveau, exp, pv, fin ('terminee' ou 'mort'), etape, tueur.
+    """
+    if _worker_db is None:
+        _worker_init()
+    conn, cur = _worker_db
+    create_player(cur, conn, f"Bot {seed}", id_classe)
+    session = Session(seed, decide=decision_provider(provider, seed), output=NULL_FRAMES)
+    result = play_adventure(cur, conn, session)
+    niveau, exp, pv, _ = final_player_stats(cur)
+    return {'seed': seed, 'classe': id_classe, 'niveau': niveau, 'exp': exp, 'pv': pv,
+            'fin': result['fin'], 'etape': result['etape'], 'tueur': result['tueur']}
+
+def _run_one(args):
+    return run_headless_adventure(*args)
+
+class RunAggregate:
+    """Statistiques d'un lot, mises à jour partie par partie (on ne garde pas les parties)."""
+    def __init__(self):
+        self.parties = 0
+        self.terminees = 0
+        self.somme_niveau = 0
+        self.somme_exp = 0
+        self.morts_par_etape = {}
+        self.tueurs = {}
+
+    def add(self, summary):
+        self.parties += 1
+        self.somme_niveau += summary['niveau']
+        self.somme_exp += summary['exp']
+        if summary['fin'] == 'terminee':
+            self.terminees += 1
+        else:
+            self.morts_par_etape[summary['etape']] = self.morts_par_etape.get(summary['etape'], 0) + 1
+            tueur = summary['tueur'] or "mauvaise décision"
+            self.tueurs[tueur] = self.tueurs.get(tueur, 0) + 1
+
+def run_batch(n, id_classe, provider='ia', processes=None, seed=0, out=None):
+    """
+    Joue n aventures réparties sur un pool de processus (un par coeur par défaut).
+    Les résumés arrivent au fil de l'eau : ils sont ajoutés à un RunAggregate et,
+    si out est un fichier ouvert, écrits une ligne JSON par partie.
+    """
+    aggregate = RunAggregate()
+    taches = ((seed + i, id_classe, provider) for i in range(n))
+    with multiprocessing.Pool(processes, initializer=_worker_init) as pool:
+        for summary in pool.imap_unordered(_run_one, taches, chunksize=16):
+            aggregate.add(summary)
+            if out is not None:
+                out.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    return aggregate
+
+# ---------------------------
+# Mesures de performance
+# ---------------------------
+
+def _dict_state(player, enemy):
+    """Ancien format de l'état de combat (dicts), gardé seulement pour comparer."""
+    return {'player_pv': player['pv'], 'player_atk': player['attaque'],
+            'enemy_pv': enemy.pv, 'enemy_atk': enemy.attaque, 'skill_used': False, 'turn': 1,
+            'durations': {'player_buff_atk':0, 'player_def_reduce_pct':0, 'enemy_frozen':0, 'player_invincible':0, 'player_atk_mult':1.0}}
+
+def _dict_attack_turn(state):
+    """Un tour 'attaquer' avec l'ancien format : copie des dicts et .get() à chaque tour."""
+    s = dict(state)
+    durations = dict(state['durations'])
+    s['durations'] = durations
+    s['enemy_pv'] -= int(math.ceil(s['player_atk'] * durations['player_atk_mult']))
+    if durations.get('enemy_frozen',0) > 0:
+        durations['enemy_frozen'] -= 0.5
+    elif durations.get('enemy_stun',0) > 0:
+        durations['enemy_stun'] -= 0.5
+    else:
+        dmg_received = s['enemy_atk']
+        if durations.get('player_def_reduce_pct',0):
+            dmg_received = int(math.ceil(dmg_received * (1 - durations['player_def_reduce_pct'])))
+        if durations.get('player_invincible',0) > 0:
+            dmg_received = 0
+        s['player_pv'] -= dmg_received
+        if durations.get('player_buff_atk',0) > 0:
+            durations['player_buff_atk'] -= 1
+        if durations.get('player_def_reduce_turns',0):
+            durations['player_def_reduce_turns'] -= 1
+        if durations.get('player_invincible',0) > 0:
+            durations['player_invincible'] -= 0.5
+        if durations.get('player_atk_mult',1.0) != 1.0 and durations.get('player_buff_atk',0) == 0:
+            durations['player_atk_mult'] = 1.0
+    s['turn'] += 1
+    return s
+
+def _slots_attack_turn(state):
+    """Le même tour avec CombatState / Effects."""
+    s = state.copy()
+    durations = s.durations
+    s.enemy_pv -= int(math.ceil(s.player_atk * durations.player_atk_mult))
+    if durations.enemy_frozen > 0:
+        durations.enemy_frozen -= 0.5
+    elif durations.enemy_stun > 0:
+        durations.enemy_stun -= 0.5
+    else:
+        dmg_received = s.enemy_atk
+        if durations.player_def_reduce_pct:
+            dmg_received = int(math.ceil(dmg_received * (1 - durations.player_def_reduce_pct)))
+        if durations.player_invincible > 0:
+            dmg_received = 0
+        s.player_pv -= dmg_received
+        if durations.player_buff_atk > 0:
+            durations.player_buff_atk -= 1
+        if durations.player_def_reduce_turns:
+            durations.player_def_reduce_turns -= 1
+        if durations.player_invincible > 0:
+            durations.player_invincible -= 0.5
+        if durations.player_atk_mult != 1.0 and durations.player_buff_atk == 0:
+            durations.player_atk_mult = 1.0
+    s.turn += 1
+    return s
+
+def _allocated_bytes(make, n=10000):
+    """Octets alloués en moyenne par appel de make()."""
+    tracemalloc.start()
+    garde = [make() for _ in range(n)]
+    taille, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del garde
+    return taille / n
+
+def bench_state_cli(args):
+    """python "The Fantasy.py" --bench-etat [nombre de tours]"""
+    n = int(args[0]) if args else 200000
+    player = {'pv': 10**9, 'attaque': 1}
+    enemy = new_enemy_instance((1, 'Zombie', 10**9, 4, 'basique'))
+    avant = _dict_state(player, enemy)
+    apres = new_combat_state(player, enemy)
+
+    print(f"Etat de combat : dicts (avant) contre __slots__ (après), {n} tours 'attaquer'")
+    print(f"  mémoire par tour   : {_allocated_bytes(lambda: _dict_attack_turn(avant)):7.0f} o -> {_allocated_bytes(lambda: _slots_attack_turn(apres)):7.0f} o")
+    t_avant = timeit.timeit(lambda: _dict_attack_turn(avant), number=n) / n * 1e9
+    t_apres = timeit.timeit(lambda: _slots_attack_turn(apres), number=n) / n * 1e9
+    print(f"  temps par tour     : {t_avant:7.0f} ns -> {t_apres:7.0f} ns")
+    t_resolve = timeit.timeit(lambda: resolve_turn(apres, '1', None), number=n) / n * 1e9
+    print(f"  resolve_turn('1')  : {t_resolve:7.0f} ns")
+
+def print_win_rates(cur, matrix, titre):
+    """Affiche une matrice {(id_classe, id_ennemi, scale): taux} : min - max selon le scale."""
+    classes = {c[0]: c[1] for c in fetch_classes(cur)}
+    enemies = {e[0]: e[1] for e in enemy_catalog(cur).rows}
+    print(titre)
+    for id_classe, nom_classe in classes.items():
+        print(f"\n{nom_classe}")
+        for id_ennemi, nom_ennemi in enemies.items():
+            taux = [v for (c, e, _), v in matrix.items() if c == id_classe and e == id_ennemi]
+            print(f"   {nom_ennemi[:40]:40} {min(taux):7.1%} - {max(taux):7.1%}")
+
+def simulation_cli(args):
+    """python "The Fantasy.py" --simulation [nombre de combats par case]"""
+    n = int(args[0]) if args else 1000000
+    conn, cur = init_db(":memory:")
+    matrix = win_rate_matrix(cur, n=n)
+    print_win_rates(cur, matrix, f"Taux de victoire ({n} combats par case, compétence au 1er tour) : min - max selon le scale")
+    conn.close()
+
+def solveur_cli(args):
+    """python "The Fantasy.py" --solveur"""
+    conn, cur = init_db(":memory:")
+    matrix = solve_matrix(cur)
+    print_win_rates(cur, {k: v['victoire'] for k, v in matrix.items()}, "Probabilité exacte de victoire (compétence au 1er tour) : min - max selon le scale")
+    conn.close()
 
 # ---------------------------
 # Liste des événements(50 questions)
@@ -1765,29 +3686,323 @@ def get_story_events():
     ]
     return ("Village",STORY_EVENTS)
 
-def ask_yes_no(question):
-    r = input("O/N : ").strip().lower()
-    while r not in ('o','n'):
-        r = input("Réponds par O ou N : ").strip().lower()
+# ---------------------------
+# Session : hasard et journal des choix
+# ---------------------------
+# Chaque partie a son propre générateur aléatoire (avec une graine) et note
+# toutes les réponses du joueur. Avec la graine et les réponses on peut
+# rejouer la partie à l'identique, sans terminal (voir replay_cli).
+
+REPLAY_FILE = "derniere_partie.replay"
+REPLAY_MAGIC = b"FRPL"
+# version 2 : le hasard est re-semé à chaque étape (voir Session.start_step)
+REPLAY_VERSION = 2
+
+class Session:
+    """Hasard et réponses du joueur pour une partie."""
+    def __init__(self, seed=None, replay=None, decide=None, output=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # indice de la réponse choisie parmi les réponses valides, dans l'ordre
+        self.answers = []
+        self._replay = iter(replay) if replay is not None else None
+        # fournisseur de décisions à la place du clavier (voir DECISION_PROVIDERS)
+        self.decide = decide
+        # derniers snapshots (bytes), et fichier où écrire le dernier si besoin
+        self.snapshots = collections.deque(maxlen=SNAPSHOT_HISTORY)
+        self.snapshot_file = None
+        # CombatTelemetry qui reçoit chaque tour de combat, ou None
+        self.telemetry = None
+        # FrameOutput de la partie (une par session : les parties entrelacées ne mélangent pas leur texte)
+        self.output = output if output is not None else FrameOutput()
+
+    def start_step(self, step):
+        """Re-sème le hasard pour l'étape : il ne dépend que de (graine, étape)."""
+        self.rng.seed(self.seed + (step << 64))
+
+    def take_snapshot(self, snap):
+        data = pack_snapshot(snap)
+        self.snapshots.append(data)
+        if self.snapshot_file is not None:
+            write_snapshot(self.snapshot_file, data)
+
+    def answer(self, prompt):
+        """
+        Réponse à un Prompt : depuis le replay, le fournisseur de décisions,
+        ou le clavier (on redemande tant que la réponse n'est pas valide).
+        """
+        if self._replay is not None:
+            return prompt.valid[next(self._replay)]
+        if self.decide is not None:
+            return self.decide(prompt.kind, prompt.valid, prompt.context)
+        r = input(prompt.text).strip()
+        if prompt.lower:
+            r = r.lower()
+        while r not in prompt.valid:
+            r = input(prompt.retry_text).strip()
+            if prompt.lower:
+                r = r.lower()
+        return r
+
+    def record(self, prompt, answer):
+        """Note la réponse donnée à prompt (pour le replay)."""
+        if answer not in prompt.valid:
+            raise ValueError(f"Réponse {answer!r} invalide pour {prompt.label} (attendu : {', '.join(prompt.valid)})")
+        self.answers.append(prompt.valid.index(answer))
+
+# libellé de chaque sorte de Prompt, pour les messages (formaté seulement quand on l'affiche)
+PROMPT_LABELS = {
+    'oui_non': "oui/non, étape {}",
+    'combat': "action de combat, tour {}",
+}
+
+class Prompt:
+    """Question posée par la partie au joueur (ou à ce qui le remplace)."""
+    __slots__ = ('kind', 'number', 'valid', 'text', 'retry_text', 'lower', 'context')
+
+    def __init__(self, kind, number, valid, text, retry_text, lower=False, context=None):
+        self.kind = kind
+        # numéro d'étape ou de tour, brut : le libellé n'est construit que s'il est lu
+        self.number = number
+        self.valid = valid
+        self.text = text
+        self.retry_text = retry_text
+        self.lower = lower
+        self.context = context
+
+    @property
+    def label(self):
+        return PROMPT_LABELS[self.kind].format(self.number)
+
+def yes_no_prompt(step):
+    return Prompt('oui_non', step + 1, ('o','n'), "O/N : ", "Réponds par O ou N : ", True, step)
+
+def combat_prompt(state, skill):
+    return Prompt('combat', state.turn, ('1','2','3'),
+                  "Votre action (1/2/3) : ", "Choix invalide, entrez 1, 2 ou 3 : ", False, (state, skill))
+
+def run_machine(machine, session):
+    """
+    Fait tourner une partie (générateur qui yield des Prompt) en répondant
+    avec session.answer. C'est le pilote du jeu en terminal ; un serveur peut
+    faire la même chose avec des milliers de parties entrelacées.
+    """
+    try:
+        prompt = next(machine)
+        while True:
+            prompt = machine.send(session.answer(prompt))
+    except StopIteration as fin:
+        return fin.value
+
+def save_replay(path, session, nom, id_classe, final_stats):
+    """
+    Ecrit la partie dans un petit fichier binaire :
+    en-tête (graine, classe, nom), stats finales (niveau, exp, pv, attaque)
+    puis les réponses, 4 par octet (2 bits chacune).
+    """
+    nom_bytes = nom.encode('utf-8')
+    packed = pack_answers(session.answers)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sBQBH', REPLAY_MAGIC, REPLAY_VERSION, session.seed, id_classe, len(nom_bytes)))
+        f.write(nom_bytes)
+        f.write(struct.pack('<4i', *final_stats))
+        f.write(struct.pack('<I', len(session.answers)))
+        f.write(packed)
+
+def load_replay(path):
+    """Relit un fichier écrit par save_replay : (seed, nom, id_classe, final_stats, answers)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, seed, id_classe, nom_len = struct.unpack_from('<4sBQBH', data, 0)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f"{path} n'est pas un replay du jeu (ou version inconnue)")
+    pos = struct.calcsize('<4sBQBH')
+    nom = data[pos:pos + nom_len].decode('utf-8')
+    pos += nom_len
+    final_stats = struct.unpack_from('<4i', data, pos)
+    pos += struct.calcsize('<4i')
+    (count,) = struct.unpack_from('<I', data, pos)
+    pos += 4
+    answers = unpack_answers(data, pos, count)
+    return seed, nom, id_classe, final_stats, answers
+
+def pack_answers(answers):
+    """Réponses (0 à 3) rangées 4 par octet."""
+    packed = bytearray((len(answers) + 3) // 4)
+    for i, code in enumerate(answers):
+        packed[i // 4] |= code << (2 * (i % 4))
+    return bytes(packed)
+
+def unpack_answers(data, pos, count):
+    return [(data[pos + i // 4] >> (2 * (i % 4))) & 3 for i in range(count)]
+
+# ---------------------------
+# Sauvegardes rapides (snapshots)
+# ---------------------------
+# Tout ce qu'il faut pour reprendre une aventure au début d'une étape tient en
+# quelques dizaines d'octets : le hasard est re-semé à chaque étape à partir de
+# (graine, étape), donc il suffit de garder la graine et pas l'état du générateur.
+
+SNAPSHOT_FILE = "sauvegarde.snapshot"
+SNAPSHOT_MAGIC = b"FSNP"
+# version 2 : boss vaincus et tours de combat (classements)
+# version 3 : id du héros (la base est gardée, la reprise continue le même héros)
+SNAPSHOT_VERSION = 3
+# nombre de snapshots gardés en mémoire par session
+SNAPSHOT_HISTORY = 16
+_SNAPSHOT_HEADER = struct.Struct('<4sBQIBHHiiiiiHIH')
+_NO_NODE = 0xFFFF
+
+AdventureSnapshot = collections.namedtuple('AdventureSnapshot',
+    'seed id_joueur id_classe nom step index xp exp pv attaque niveau boss_vaincus tours answers')
+
+def pack_snapshot(snap):
+    nom_bytes = snap.nom.encode('utf-8')
+    return b''.join((
+        _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snap.seed, snap.id_joueur, snap.id_classe, snap.step,
+                              _NO_NODE if snap.index is None else snap.index,
+                              snap.xp, snap.exp, snap.pv, snap.attaque, snap.niveau,
+                              snap.boss_vaincus, snap.tours, len(nom_bytes)),
+        nom_bytes,
+        struct.pack('<I', len(snap.answers)),
+        pack_answers(snap.answers),
+    ))
+
+def unpack_snapshot(data):
+    (magic, version, seed, id_joueur, id_classe, step, index, xp, exp, pv, attaque, niveau,
+     boss_vaincus, tours, nom_len) = _SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Sauvegarde invalide (ou version inconnue)")
+    pos = _SNAPSHOT_HEADER.size
+    nom = data[pos:pos + nom_len].decode('utf-8')
+    pos += nom_len
+    (count,) = struct.unpack_from('<I', data, pos)
+    answers = unpack_answers(data, pos + 4, count)
+    return AdventureSnapshot(seed, id_joueur, id_classe, nom, step, None if index == _NO_NODE else index,
+                             xp, exp, pv, attaque, niveau, boss_vaincus, tours, answers)
+
+def write_snapshot(path, data):
+    """Ecrit la sauvegarde d'un coup (fichier temporaire puis renommage)."""
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def read_snapshot(path=SNAPSHOT_FILE):
+    with open(path, 'rb') as f:
+        return unpack_snapshot(f.read())
+
+def final_player_stats(cur, id_joueur=None):
+    """(niveau, exp, pv, attaque) du joueur (le dernier créé par défaut), ce qu'on compare au replay."""
+    row = get_player(cur, id_joueur)
+    return (row[7], row[4], row[5], row[6])
+
+# ---------------------------
+# Histoire compilée
+# ---------------------------
+# Les événements et les décors sont compilés une seule fois au chargement en
+# tuples indexés par des entiers : chaque noeud garde directement son décor
+# (lignes déjà découpées et largeur déjà mesurée) et l'indice du noeud suivant
+# pour chaque réponse. Une histoire linéaire n'est qu'un cas particulier de graphe.
+
+# Un décor prêt à afficher
+Scene = collections.namedtuple('Scene', 'index nom art lines width')
+# Un événement de l'histoire ; suivant_oui / suivant_non valent None en fin d'histoire
+StoryNode = collections.namedtuple('StoryNode', 'index decor texte scene suivant_oui suivant_non')
+Story = collections.namedtuple('Story', 'nodes scenes start')
+
+def compile_scenes(decors):
+    """{nom: art} -> ({nom: Scene}, tuple de Scene)."""
+    by_name = {}
+    for nom, art in decors.items():
+        by_name[nom] = Scene(len(by_name), nom, art, *ART_CACHE.shape(art))
+    return by_name, tuple(by_name.values())
+
+def compile_story(events, decors, start=0):
+    """
+    events: liste de (decor, texte) pour une histoire linéaire, ou de
+    (decor, texte, suivant_oui, suivant_non) avec les indices des noeuds suivants
+    (None = fin de l'histoire) pour une histoire à embranchements.
+    """
+    scenes_by_name, scenes = compile_scenes(decors)
+    nodes = []
+    for i, event in enumerate(events):
+        decor, texte = event[0], event[1]
+        if len(event) > 2:
+            suivant_oui, suivant_non = event[2], event[3]
+        else:
+            suivant_oui = suivant_non = i + 1 if i + 1 < len(events) else None
+        for suivant in (suivant_oui, suivant_non):
+            if suivant is not None and not 0 <= suivant < len(events):
+                raise ValueError(f"Evénement {i} ({decor}) : noeud suivant {suivant} inexistant")
+        nodes.append(StoryNode(i, decor, texte, scenes_by_name.get(decor), suivant_oui, suivant_non))
+    return Story(tuple(nodes), scenes, start)
+
+def next_node(story, node, answer_yes):
+    """Indice du noeud suivant (None en fin d'histoire)."""
+    return node.suivant_oui if answer_yes else node.suivant_non
+
+STORY = compile_story(get_story_events()[1], DECORS)
+
+def ask_yes_no(question, session=None, step=0):
+    if session is None:
+        session = Session()
+    prompt = yes_no_prompt(step)
+    r = session.answer(prompt)
+    session.record(prompt, r)
     return r == 'o'
 
-def play_adventure(cur, conn):
-    # Récupère le tuple de get_story_events
-    story = get_story_events()
-    if not story:
-        print("Erreur : aucun événement trouvé.")
+def play_adventure(cur, conn, session=None, store=None, id_joueur=None, story=STORY, resume=None):
+    """
+    Joue les 50 étapes en terminal (ou avec le fournisseur de décisions de la session).
+    Renvoie {'fin': 'terminee' ou 'mort', 'etape': numéro, 'tueur': nom ou None}.
+    """
+    if session is None:
+        session = Session()
+    return run_machine(adventure_machine(cur, conn, session, store, id_joueur, story, resume), session)
+
+def adventure_machine(cur, conn, session=None, store=None, id_joueur=None, story=STORY, resume=None, player_row=None):
+    """
+    L'aventure sous forme de générateur : elle yield un Prompt à chaque question
+    et reçoit la réponse par send(). Les stats du joueur passent par store
+    (PlayerStore) et sont écrites aux checkpoints, et dans tous les cas à la fin
+    (même sur erreur ou si le générateur est abandonné).
+    id_joueur: héros à jouer (le dernier créé par défaut).
+    story: histoire compilée par compile_story (STORY par défaut).
+    resume: AdventureSnapshot pour reprendre au début d'une étape.
+    player_row: ligne du héros déjà lue (comme get_player) ; sinon elle est lue avec cur.
+    """
+    if session is None:
+        session = Session()
+    if store is None:
+        store = PlayerStore(cur, conn)
+    try:
+        return (yield from adventure_steps(cur, conn, session, store, id_joueur, story, resume, player_row))
+    finally:
+        session.output.flush()
+        # toujours écrit, même si flush_on ne contient aucun point intermédiaire
+        store.flush()
+
+def adventure_steps(cur, conn, session, store, id_joueur=None, story=STORY, resume=None, player_row=None):
+    out = session.output
+    # l'histoire est compilée une fois au chargement (voir compile_story)
+    if not story.nodes:
+        if out.level >= VERBOSITY_STEPS:
+            out.line("Erreur : aucun événement trouvé.")
         return
-    # On récupère décor initial et events
-    decor_initial, events = story
 
-    total_steps = len(events)
+    total_steps = len(story.nodes)
+    index = story.start
     step = 0
     xp = 0
 
     # Récupération du joueur
-    row = get_player(cur)
+    row = player_row if player_row is not None else get_player(cur, id_joueur)
     if not row:
-        print("Aucun joueur trouvé, quittez et créez un joueur.")
+        if out.level >= VERBOSITY_STEPS:
+            out.line("Aucun joueur trouvé, quittez et créez un joueur.")
         return
     player = {
         'id_joueur': row[0],
@@ -1798,77 +4013,122 @@ def play_adventure(cur, conn):
         'pv': row[5],
         'attaque': row[6],
         'niveau': row[7],
-        'classe_nom': row[8]
+        'classe_nom': row[8],
+        'boss_vaincus': row[9],
+        'meilleur_tours': row[10],
+        # tours de combat joués pendant cette aventure
+        'tours': 0
     }
 
-    comp_row = fetch_comp_for_class(cur, player['id_classe'])
-    comp_data = (comp_row[0], comp_row[1], comp_row[2], comp_row[3], comp_row[4], comp_row[5])
+    # reprise d'une sauvegarde : on repart de l'étape enregistrée avec les stats enregistrées
+    if resume is not None:
+        step, index, xp = resume.step, resume.index, resume.xp
+        player['exp'], player['pv'], player['attaque'], player['niveau'] = resume.exp, resume.pv, resume.attaque, resume.niveau
+        player['boss_vaincus'], player['tours'] = resume.boss_vaincus, resume.tours
+        session.answers = list(resume.answers)
+        store.update(player['id_joueur'], pv=player['pv'], exp=player['exp'], attaque=player['attaque'], niveau=player['niveau'],
+                     boss_vaincus=player['boss_vaincus'])
 
-    print(f"\nDébut de l'aventure de {player['nom']} le {player['classe_nom']} (PV={player['pv']}, ATQ={player['attaque']})")
+    # toutes les compétences sont chargées une fois, on garde celle du joueur
+    skills = load_skills(cur)
+    skill = skills[player['id_competence']]
 
-    basic_enemies = [fetch_enemy_by_name(cur, 'Zombie'), fetch_enemy_by_name(cur, 'Squelette'),fetch_enemy_by_name(cur, 'Groupe de pillard'),fetch_enemy_by_name(cur, 'Goblin'),fetch_enemy_by_name(cur, 'Rat')]
-    boss_base = [e for e in [fetch_enemy_by_name(cur, "Jack Chistophe, Prêtre de l'Evangile de l'Eglise Ulmer Münster"), fetch_enemy_by_name(cur, 'Yhorm le Géant'), fetch_enemy_by_name(cur,'Lothric, Prince cadet et Lorian, Prince aîné'), fetch_enemy_by_name(cur,"Ilyan, L'indompteur sanguinaire de la Tricky Tower de Dieuv"),fetch_enemy_by_name(cur,'Le Roi sans Nom')] if e is not None]
+    if out.level >= VERBOSITY_STEPS:
+        out.line(f"\nDébut de l'aventure de {player['nom']} le {player['classe_nom']} (PV={player['pv']}, ATQ={player['attaque']})")
+
+    # ennemis de base et boss dans l'ordre des id (le catalogue est chargé une fois)
+    catalog = enemy_catalog(cur)
+    basic_enemies = catalog.of_type('basique')
+    boss_base = catalog.of_type('boss')
+    if not basic_enemies:
+        if out.level >= VERBOSITY_STEPS:
+            out.line("Erreur : aucun ennemi de base trouvé.")
+        return
 
     # Boucle sur les étapes de l’aventure
-    while step < total_steps:
-        decor_step, event_text = events[step]  # récupère le décor et le texte
-        print(f"\n== Étape {step+1}/{total_steps} ==")
+    while index is not None and step < total_steps:
+        session.start_step(step)
+        session.take_snapshot(AdventureSnapshot(session.seed, player['id_joueur'], player['id_classe'], player['nom'], step, index, xp,
+                                                player['exp'], player['pv'], player['attaque'], player['niveau'],
+                                                player['boss_vaincus'], player['tours'], session.answers))
+        node = story.nodes[index]  # récupère le décor et le texte
+        if out.level >= VERBOSITY_STEPS:
+            out.line(f"\n== Étape {step+1}/{total_steps} ==")
     
-        # Affichage du décor si présent
-        if decor_step in DECORS:
-            print_ascii(DECORS[decor_step])
+            # Affichage du décor si présent
+            if node.scene is not None:
+                out.art(node.scene.art)
     
-        # Affichage du texte
-        print(event_text)
+            # Affichage du texte
+            out.line(node.texte)
         # Demande au joueur Oui/Non
-        chc = ask_yes_no(event_text + "")
+        prompt = yes_no_prompt(step)
+        out.flush()
+        r = yield prompt
+        session.record(prompt, r)
+        chc = r == 'o'
         if chc:
             reward = 7
-            if random.random() < 0.30:
-                be = random.choice(basic_enemies)
+            if session.rng.random() < 0.30:
+                be = session.rng.choice(basic_enemies)
                 scale = 1.0 + (step / total_steps) * 0.5
-                enemy = new_enemy_instance(be, scale=scale)
-                print(f" Rencontre : {enemy['nom']} (PV {enemy['pv']}, ATK {enemy['attaque']})")
-                success = combat_turn_by_turn(cur, conn, player, enemy, comp_data)
+                enemy = new_enemy_instance(be, scale=scale, pool=ENEMY_POOL)
+                if out.level >= VERBOSITY_STEPS:
+                    out.line(f" Rencontre : {enemy.nom} (PV {enemy.pv}, ATK {enemy.attaque})")
+                success = yield from combat_machine(player, enemy, skill, session, store)
+                ENEMY_POOL.release(enemy)
                 if not success:
-                    print("Fin de la partie.")
-                    return
+                    if out.level >= VERBOSITY_STEPS:
+                        out.line("Fin de la partie.")
+                    return {'fin': 'mort', 'etape': step+1, 'tueur': enemy.nom}
                 else:
                     reward += 7
-            else:
-                print("Vous avancez sans rencontrer d'ennemis pour l'instant.")
+            elif out.level >= VERBOSITY_STEPS:
+                out.line("Vous avancez sans rencontrer d'ennemis pour l'instant.")
             xp += reward
-            print(f"+{reward} XP (Total local = {xp})")
+            if out.level >= VERBOSITY_STEPS:
+                out.line(f"+{reward} XP (Total local = {xp})")
         else:
-            loss = random.randint(0, 2)
+            loss = session.rng.randint(0, 2)
             player['pv'] -= loss
-            print(f"Vous avez choisi de ne pas agir : vous perdez {loss} PV (PV restants : {player['pv']})")
+            if out.level >= VERBOSITY_STEPS:
+                out.line(f"Vous avez choisi de ne pas agir : vous perdez {loss} PV (PV restants : {player['pv']})")
             if player['pv'] <= 0:
-                print("Vous êtes mort·e à cause d'une mauvaise décision...")
-                update_player_stats(cur, conn, player['id_joueur'], pv=0, exp=player['exp'])
-                return
+                if out.level >= VERBOSITY_STEPS:
+                    out.line("Vous êtes mort·e à cause d'une mauvaise décision...")
+                store.update(player['id_joueur'], pv=0, exp=player['exp'])
+                return {'fin': 'mort', 'etape': step+1, 'tueur': None}
 
         step += 1
+        index = next_node(story, node, chc)
 
         # toutes les 10 étapes il y a un boss qui spawn
         if step % 10 == 0:
             boss_index = (step // 10) - 1
-            base_boss = boss_base[boss_index % len(boss_base)]
             scale = 1.0 + (step/total_steps) * 1.2
-            boss = new_enemy_instance(base_boss, scale=scale)
+            # sans boss dans la table on passe au message "boss pas chargé"
+            boss = new_enemy_instance(boss_base[boss_index % len(boss_base)], scale=scale, pool=ENEMY_POOL) if boss_base else None
             if boss is None:
-                print("Le boss n'a pas pu être chargé, vous continuez votre route.")
+                if out.level >= VERBOSITY_STEPS:
+                    out.line("Le boss n'a pas pu être chargé, vous continuez votre route.")
             else:
-                print(f"\n!!! Rencontre majeure : Boss {boss['nom']} (PV {boss['pv']}, ATK {boss['attaque']}) !!!")
-                success = combat_turn_by_turn(cur, conn, player, boss, comp_data)
+                if out.level >= VERBOSITY_STEPS:
+                    out.line(f"\n!!! Rencontre majeure : Boss {boss.nom} (PV {boss.pv}, ATK {boss.attaque}) !!!")
+                success = yield from combat_machine(player, boss, skill, session, store)
+                ENEMY_POOL.release(boss)
                 if not success:
-                    print("Vous avez été vaincu par le boss... fin.")
-                    return
+                    if out.level >= VERBOSITY_STEPS:
+                        out.line("Vous avez été vaincu par le boss... fin.")
+                    return {'fin': 'mort', 'etape': step, 'tueur': boss.nom}
                 else:
                     # big XP
                     gained = 50 + step*2
-                    print(f"Boss terrassé ! +{gained} XP")
+                    if out.level >= VERBOSITY_STEPS:
+                        out.line(f"Boss terrassé ! +{gained} XP")
                     xp += gained
+                    player['boss_vaincus'] += 1
+                    store.update(player['id_joueur'], boss_vaincus=player['boss_vaincus'])
+                    store.checkpoint('boss')
 
         # Tout les 20XP on gagne 1 LVL dans l'histoire
         # On compare l'XP de la base de donnée et on ajoute l'XP gagnée a lXP deja dans la base
@@ -1876,38 +4136,62 @@ def play_adventure(cur, conn):
         new_level = 1 + (total_exp_after // 20)
         if new_level > player['niveau']:
             levels_gained = new_level - player['niveau']
-            print(f"\n✨ NIVEAU ! Vous montez de {levels_gained} niveau(s) : {player['niveau']} -> {new_level}")
+            if out.level >= VERBOSITY_STEPS:
+                out.line(f"\n✨ NIVEAU ! Vous montez de {levels_gained} niveau(s) : {player['niveau']} -> {new_level}")
             for _ in range(levels_gained):
                 player['attaque'] += 1
                 player['pv'] += 5  # On augmente les PV max du joueurs a chaque LVL
             player['niveau'] = new_level
             # On update les nouvelles stats du joueurs dans la base de donnée
-            update_player_stats(cur, conn, player['id_joueur'], pv=player['pv'], attaque=player['attaque'], niveau=player['niveau'])
+            store.update(player['id_joueur'], pv=player['pv'], attaque=player['attaque'], niveau=player['niveau'])
+
+        # fin de l'étape : on écrit ce qui a changé (si 'etape' est dans store.flush_on)
+        store.checkpoint('etape')
 
     # On fini le jeu quand il n'y a plsu d'événements
     player['exp'] += xp
-    update_player_stats(cur, conn, player['id_joueur'], pv=player['pv'], exp=player['exp'], attaque=player['attaque'], niveau=player['niveau'])
-    print("\n Vous avez terminé l'aventure ! Résumé final :")
-    print(f"Héros : {player['nom']} | Classe : {player['classe_nom']} | Niveau : {player['niveau']} | EXP : {player['exp']} | PV restants : {player['pv']} | ATQ : {player['attaque']}")
-    print("Bravo !")
+    store.update(player['id_joueur'], pv=player['pv'], exp=player['exp'], attaque=player['attaque'], niveau=player['niveau'])
+    # classement des aventures les plus rapides
+    if player['meilleur_tours'] is None or player['tours'] < player['meilleur_tours']:
+        player['meilleur_tours'] = player['tours']
+        store.update(player['id_joueur'], meilleur_tours=player['tours'])
+    if out.level >= VERBOSITY_STEPS:
+        out.line("\n Vous avez terminé l'aventure ! Résumé final :")
+        out.line(f"Héros : {player['nom']} | Classe : {player['classe_nom']} | Niveau : {player['niveau']} | EXP : {player['exp']} | PV restants : {player['pv']} | ATQ : {player['attaque']}")
+        out.line("Bravo !")
+    return {'fin': 'terminee', 'etape': total_steps, 'tueur': None}
 
 # ---------------------------
 # Lancement du jeu
 # ---------------------------
-def main():
-    conn, cur = init_db()
-
+def main(path=DB, disk_copy=None, interval=MEMORY_SNAPSHOT_INTERVAL):
+    """
+    path: base du jeu (':memory:' pour ne rien écrire sur le disque).
+    disk_copy: avec une base en mémoire, fichier où la copier toutes les interval secondes.
+    """
     print("=== JEU FANTASY (NSI) ===")
+    if os.path.exists(SNAPSHOT_FILE):
+        print("Une aventure a été interrompue. Voulez-vous la reprendre ?")
+        if ask_yes_no("Reprendre ?"):
+            # même base que la partie interrompue (en mémoire avec --memoire)
+            resume_game(SNAPSHOT_FILE, path, disk_copy, interval)
+            return
+
+    db = open_database(path)
+    conn, cur = init_db(db=db)
+    ART_CACHE.watch_resize()
     nom = input("Nom de votre héros : ").strip()
     classes = fetch_classes_with_competence(cur)
-    print("\nChoisissez une classe :\n")
+    # tout l'écran de choix est assemblé puis écrit d'un coup
+    screen = ["\nChoisissez une classe :\n\n"]
     for c in classes:
-        print(f"{c[0]} - {c[1]}")
+        screen.append(f"{c[0]} - {c[1]}\n")
         if c[1] in CLASS_LOGOS:
-            print_ascii(CLASS_LOGOS[c[1]])
-        print(f"   PV : {c[2]} | ATQ : {c[3]}")
-        print(f"   Capacité : {c[4]}")
-        print(f"   Effet : {c[5]}\n")
+            screen.append(ART_CACHE.block(CLASS_LOGOS[c[1]]))
+        screen.append(f"   PV : {c[2]} | ATQ : {c[3]}\n"
+                      f"   Capacité : {c[4]}\n"
+                      f"   Effet : {c[5]}\n\n")
+    sys.stdout.write(''.join(screen))
     while True:
         try:
             choix = int(input("Id de la classe choisie : ").strip())
@@ -1918,18 +4202,582 @@ def main():
         except:
             print("Entrez un nombre.")
 
-    create_player(cur, conn, nom, choix)
-    player_row = get_player(cur)
+    # la base est partagée avec les parties précédentes : on garde l'id de notre héros
+    id_joueur = create_player(cur, conn, nom, choix)
+    player_row = get_player(cur, id_joueur)
     print(f"\nBienvenue {player_row[1]} le {player_row[8]} ! (PV: {player_row[5]}, ATQ: {player_row[6]})")
     classe_nom = player_row[8]
     if classe_nom in CLASS_LOGOS:
         print_ascii(CLASS_LOGOS[classe_nom])
     input("\nAppuyez sur Entrée pour commencer l'aventure : Le Village Oublié")
 
-    play_adventure(cur, conn)
+    # on garde la graine et les réponses pour pouvoir rejouer la partie
+    session = Session()
+    # sauvegarde à chaque étape pour pouvoir reprendre après un plantage
+    session.snapshot_file = SNAPSHOT_FILE
+    session.telemetry = CombatTelemetry(db)
+    copies = DiskSnapshots(db, disk_copy, interval) if disk_copy is not None else None
+    try:
+        # play_adventure écrit les stats en attente même si le jeu plante ou sur Ctrl+C
+        play_adventure(cur, conn, session, PlayerStore(cur, conn), id_joueur)
+        finish_game(cur, conn, session, nom, choix, id_joueur)
+    finally:
+        # le thread du journal est un démon : sans close() les tours en attente seraient perdus
+        session.telemetry.close()
+        # dernière copie sur le disque, même après un plantage
+        if copies is not None:
+            copies.stop()
+    conn.close()
+
+def finish_game(cur, conn, session, nom, id_classe, id_joueur):
+    """Fin normale d'une partie : replay écrit, sauvegarde de reprise effacée."""
+    save_replay(REPLAY_FILE, session, nom, id_classe, final_player_stats(cur, id_joueur))
+    if session.snapshot_file is not None and os.path.exists(session.snapshot_file):
+        os.remove(session.snapshot_file)
+    if session.telemetry is not None:
+        session.telemetry.close()
+    rang = player_rank(conn.cursor(), id_joueur)
+    if rang is not None:
+        print(f"Classement général : {rang}e place")
+
+def resume_game(path=SNAPSHOT_FILE, db_path=DB, disk_copy=None, interval=MEMORY_SNAPSHOT_INTERVAL):
+    """
+    Reprend la partie interrompue enregistrée dans path.
+    db_path, disk_copy, interval : comme path, disk_copy et interval de main.
+    """
+    snap = read_snapshot(path)
+    db = open_database(db_path)
+    conn, cur = init_db(db=db)
+    ART_CACHE.watch_resize()
+    # on continue le héros de la sauvegarde ; s'il n'est plus dans la base on le recrée
+    row = get_player(cur, snap.id_joueur)
+    if row is not None and row[1] == snap.nom and row[2] == snap.id_classe:
+        id_joueur = snap.id_joueur
+    else:
+        id_joueur = create_player(cur, conn, snap.nom, snap.id_classe)
+    print(f"\nReprise de l'aventure de {snap.nom} à l'étape {snap.step + 1}")
+    session = Session(snap.seed)
+    session.snapshot_file = path
+    session.telemetry = CombatTelemetry(db)
+    copies = DiskSnapshots(db, disk_copy, interval) if disk_copy is not None else None
+    try:
+        play_adventure(cur, conn, session, PlayerStore(cur, conn), id_joueur, resume=snap)
+        finish_game(cur, conn, session, snap.nom, snap.id_classe, id_joueur)
+    finally:
+        session.telemetry.close()
+        if copies is not None:
+            copies.stop()
+    conn.close()
+
+def raid_cli(args):
+    """python "The Fantasy.py" --raid [héros] [ennemis] : une grande rencontre sans affichage."""
+    nb_heros = int(args[0]) if args else 200
+    nb_ennemis = int(args[1]) if len(args) > 1 else 200
+    conn, cur = init_db(":memory:")
+    skills = load_skills(cur)
+    classes = fetch_classes(cur)
+    basiques = enemy_catalog(cur).of_type('basique')
+    heroes = []
+    for i in range(nb_heros):
+        id_classe, nom, pv_base, atk_base = classes[i % len(classes)]
+        skill = skill_for_class(skills, id_classe)
+        player = {'nom': f"{nom} {i+1}", 'pv': pv_base + skill.bonus_pv, 'attaque': atk_base + skill.bonus_attaque}
+        heroes.append(hero_fighter(player, skill, vitesse=8 + i % 5))
+    enemies = [enemy_fighter(new_enemy_instance(basiques[i % len(basiques)]), vitesse=6 + i % 7) for i in range(nb_ennemis)]
+    conn.close()
+
+    encounter = Encounter(heroes, enemies)
+    debut = timeit.default_timer()
+    steps = 0
+    while encounter.outcome() is None:
+        encounter.step()
+        steps += 1
+    duree = timeit.default_timer() - debut
+    print(f"{nb_heros} héros contre {nb_ennemis} ennemis : {encounter.outcome()} en {steps} initiatives ({duree * 1000:.1f} ms)")
+    print(f"Survivants : {encounter.alive['heros']} héros, {encounter.alive['ennemis']} ennemis")
+
+def ia_cli(args):
+    """python "The Fantasy.py" --ia [profondeur] : probabilité exacte de victoire avec l'IA contre 'compétence au 1er tour'."""
+    depth = int(args[0]) if args else 8
+    conn, cur = init_db(":memory:")
+    skills = load_skills(cur)
+    print(f"Victoire exacte au scale 1.0 : compétence au 1er tour -> IA expectimax (profondeur {depth})")
+    for id_classe, nom, pv_base, atk_base in fetch_classes(cur):
+        skill = skill_for_class(skills, id_classe)
+        player = {'pv': pv_base + skill.bonus_pv, 'attaque': atk_base + skill.bonus_attaque}
+        print(f"\n{nom}")
+        for base_enemy in enemy_catalog(cur).rows:
+            state = new_combat_state(player, new_enemy_instance(base_enemy))
+            ai = ExpectimaxAI.for_matchup(skill, state, depth)
+            avant = solve_combat(state, skill, policy_skill_first)['victoire']
+            apres = solve_combat(state, skill, ai.policy)['victoire']
+            print(f"   {base_enemy[1][:40]:40} {avant:7.1%} -> {apres:7.1%}")
+    conn.close()
+
+def lot_cli(args):
+    """python "The Fantasy.py" --lot [parties] [fournisseur] [id_classe] [processus] [fichier.jsonl]"""
+    n = int(args[0]) if args else 1000
+    provider = args[1] if len(args) > 1 else 'ia'
+    id_classe = int(args[2]) if len(args) > 2 else 3
+    processes = int(args[3]) if len(args) > 3 else None
+    out = open(args[4], 'w', encoding='utf-8') if len(args) > 4 else None
+    debut = timeit.default_timer()
+    try:
+        agg = run_batch(n, id_classe, provider, processes, out=out)
+    finally:
+        if out is not None:
+            out.close()
+    duree = timeit.default_timer() - debut
+    print(f"{agg.parties} aventures ({provider}, classe {id_classe}) en {duree:.2f} s ({agg.parties / duree:.0f} par seconde)")
+    print(f"Terminées : {agg.terminees} | niveau moyen : {agg.somme_niveau / agg.parties:.1f} | EXP moyenne : {agg.somme_exp / agg.parties:.0f}")
+    for tueur, nb in sorted(agg.tueurs.items(), key=lambda t: -t[1]):
+        print(f"   {nb:7} morts : {tueur}")
+    if agg.morts_par_etape:
+        print("Etapes les plus meurtrières : " + ", ".join(f"{e} ({nb})" for e, nb in sorted(agg.morts_par_etape.items(), key=lambda t: -t[1])[:5]))
+
+def multi_cli(args):
+    """python "The Fantasy.py" --multi [parties] : beaucoup d'aventures entrelacées dans un seul processus."""
+    n = int(args[0]) if args else 1000
+    conn, cur = init_db(":memory:")
+    en_cours = collections.deque()
+    for i in range(n):
+        create_player(cur, conn, f"Bot {i}", 1 + i % 10)
+        session = Session(i, decide=AIDecisions(), output=NULL_FRAMES)
+        machine = adventure_machine(cur, conn, session, id_joueur=cur.lastrowid)
+        en_cours.append((machine, session, next(machine)))
+
+    debut = timeit.default_timer()
+    questions = 0
+    terminees = 0
+    # chaque partie répond à une seule question puis laisse la place à la suivante
+    while en_cours:
+        machine, session, prompt = en_cours.popleft()
+        questions += 1
+        try:
+            en_cours.append((machine, session, machine.send(session.answer(prompt))))
+        except StopIteration as fin:
+            terminees += fin.value['fin'] == 'terminee'
+    duree = timeit.default_timer() - debut
+    conn.close()
+    print(f"{n} aventures entrelacées : {questions} réponses en {duree:.2f} s, {terminees} terminées")
+
+def replay_cli(args):
+    """python "The Fantasy.py" --replay [fichier] : rejoue une partie sans affichage et vérifie les stats finales."""
+    path = args[0] if args else REPLAY_FILE
+    seed, nom, id_classe, final_stats, answers = load_replay(path)
+    # base en mémoire : le replay ne touche pas à fantasy.db
+    conn, cur = init_db(":memory:")
+    create_player(cur, conn, nom, id_classe)
+    debut = timeit.default_timer()
+    play_adventure(cur, conn, Session(seed, answers, output=NULL_FRAMES))
+    duree = timeit.default_timer() - debut
+    stats = final_player_stats(cur)
+    conn.close()
+    labels = ('niveau', 'exp', 'pv', 'attaque')
+    print(f"Replay de {nom} ({len(answers)} réponses) en {duree * 1000:.1f} ms")
+    for label, attendu, obtenu in zip(labels, final_stats, stats):
+        print(f"   {label:8} attendu {attendu:5}  obtenu {obtenu:5}  {'OK' if attendu == obtenu else 'DIFFERENT'}")
+    if stats != tuple(final_stats):
+        sys.exit(1)
+
+def classement_cli(args):
+    """python "The Fantasy.py" --classement [niveau|boss|rapide] [fichier] : top 10 et stats par classe."""
+    tableau = args[0] if args else 'niveau'
+    conn, cur = init_db(args[1] if len(args) > 1 else DB)
+    classes = {c[0]: c[1] for c in fetch_classes(cur)}
+    print(f"Top 10 '{tableau}'")
+    for rang, (id_joueur, nom, id_classe, *valeurs) in enumerate(leaderboard(cur, tableau), 1):
+        print(f"  {rang:2}. {nom:20} {classes.get(id_classe, '?'):15} {' / '.join(str(v) for v in valeurs)}")
+    print("\nPar classe : héros, niveau moyen, niveau max, boss vaincus, meilleur nombre de tours")
+    for nom, heros, moyen, maxi, boss, tours in class_stats(cur):
+        print(f"  {nom:15} {heros:8} {moyen:8.1f} {maxi:6} {boss:8} {tours if tours is not None else '-':>6}")
+    conn.close()
+
+def memoire_cli(args):
+    """python "The Fantasy.py" --memoire [fichier] [secondes] : le jeu sur une base en mémoire, copiée dans fichier si donné."""
+    disk_copy = args[0] if args else None
+    interval = float(args[1]) if len(args) > 1 else MEMORY_SNAPSHOT_INTERVAL
+    main(":memory:", disk_copy, interval)
+
+def reprendre_cli(args):
+    """python "The Fantasy.py" --reprendre [fichier] : reprend une partie interrompue."""
+    resume_game(args[0] if args else SNAPSHOT_FILE)
+
+# ---------------------------
+# Accès asynchrone à la base
+# ---------------------------
+# Un thread dédié possède la connexion d'écriture et vide une file de requêtes :
+# tout ce qui attend dans la file au même moment part dans un seul lot, avec un
+# seul commit. Le jeu (asyncio) attend les résultats sans jamais bloquer sur SQLite.
+
+# requêtes au plus par lot (et donc par commit)
+DB_BATCH = 256
+
+class AsyncDatabase:
+    """
+    File de requêtes vers un thread de base. db: Database (voir open_database).
+    submit() marche depuis n'importe quel thread et renvoie un concurrent.futures.Future,
+    les méthodes async sont pour asyncio.
+    """
+    def __init__(self, db, batch=DB_BATCH):
+        self.db = db
+        self.batch = batch
+        self.queue = queue.SimpleQueue()
+        # nombre de requêtes et de lots traités
+        self.requetes = 0
+        self.lots = 0
+        # après close() plus rien n'entre dans la file (le thread ne la viderait plus)
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._worker, name="fantasy-db", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, what, params=()):
+        """kind: 'un', 'tous' ou 'ecrit' (what = nom dans QUERIES), 'appel' (what = fonction)."""
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("AsyncDatabase fermée : plus de requêtes acceptées")
+            self.queue.put((kind, what, params, future))
+        return future
+
+    async def fetchone(self, name, params=()):
+        return await asyncio.wrap_future(self.submit('un', name, params))
+
+    async def fetchall(self, name, params=()):
+        return await asyncio.wrap_future(self.submit('tous', name, params))
+
+    async def execute(self, name, params=()):
+        """Ecriture, validée avec le reste du lot. Renvoie lastrowid."""
+        return await asyncio.wrap_future(self.submit('ecrit', name, params))
+
+    async def call(self, fn, *args):
+        """fn(cur, conn, *args) dans le thread de la base (ex. create_player)."""
+        return await asyncio.wrap_future(self.submit('appel', fn, args))
+
+    async def close(self):
+        """Traite ce qui est déjà dans la file puis arrête le thread ; submit() est refusé ensuite."""
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+    def _worker(self):
+        conn = self.db.connection()
+        cur = conn.cursor()
+        running = True
+        while running:
+            lot = [self.queue.get()]
+            while len(lot) < self.batch:
+                try:
+                    lot.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = []
+            ecrit = False
+            for req in lot:
+                if req is None:
+                    running = False
+                    continue
+                kind, what, params, future = req
+                try:
+                    if kind == 'appel':
+                        value = what(cur, conn, *params)
+                    else:
+                        cur.execute(QUERIES[what], params)
+                        if kind == 'un':
+                            value = cur.fetchone()
+                        elif kind == 'tous':
+                            value = cur.fetchall()
+                        else:
+                            value = cur.lastrowid
+                            ecrit = True
+                    done.append((future, value))
+                except Exception as e:
+                    future.set_exception(e)
+            # un seul commit pour toutes les écritures du lot
+            try:
+                if ecrit:
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                for future, _ in done:
+                    future.set_exception(e)
+            else:
+                for future, value in done:
+                    future.set_result(value)
+            self.requetes += len(done)
+            self.lots += 1
+
+class AsyncPlayerStore(PlayerStore):
+    """PlayerStore dont flush() envoie les écritures à une AsyncDatabase sans attendre le commit."""
+    def __init__(self, adb, flush_on=FLUSH_CHECKPOINTS):
+        super().__init__(None, None, flush_on)
+        self.adb = adb
+        self.pending = []
+
+    def flush(self):
+        for id_joueur, fields in self.dirty.items():
+            self.pending.append(self.adb.submit('ecrit', 'maj_joueur', player_update_params(id_joueur, fields)))
+        self.dirty.clear()
+
+    async def drain(self):
+        """Attend que toutes les écritures envoyées soient validées."""
+        pending, self.pending = self.pending, []
+        for future in pending:
+            await asyncio.wrap_future(future)
+
+async def play_adventure_async(adb, session, id_joueur):
+    """
+    Joue une aventure en rendant la main à asyncio après chaque réponse.
+    Toutes les lectures et écritures de la base passent par adb : la boucle
+    d'événements n'attend jamais SQLite.
+    """
+    store = AsyncPlayerStore(adb)
+    # le contenu (compétences, ennemis) vient de CONTENT : seule la ligne du héros est lue
+    row = _with_class_name(await adb.fetchone('joueur', (id_joueur,)))
+    if row is None:
+        return None  # héros introuvable
+    machine = adventure_machine(None, None, session, store, id_joueur, player_row=row)
+    prompt = next(machine)
+    while True:
+        r = session.answer(prompt)
+        await asyncio.sleep(0)
+        try:
+            prompt = machine.send(r)
+        except StopIteration as fin:
+            result = fin.value
+            break
+    await store.drain()
+    return result
+
+async def _async_parties(adb, n, provider):
+    ids = await asyncio.gather(*(adb.call(create_player, f"Bot {i}", 1 + i % 10) for i in range(n)))
+    sessions = [Session(i, decide=decision_provider(provider, i), output=NULL_FRAMES) for i in range(n)]
+    results = await asyncio.gather(*(play_adventure_async(adb, s, id_joueur) for s, id_joueur in zip(sessions, ids)))
+    await adb.close()
+    return results
+
+def async_cli(args):
+    """python "The Fantasy.py" --async [parties] [script|hasard|ia] : parties simultanées, base dans un thread dédié."""
+    n = int(args[0]) if args else 200
+    provider = args[1] if len(args) > 1 else 'hasard'
+    with tempfile.TemporaryDirectory() as dossier:
+        path = os.path.join(dossier, DB)
+        # schéma à jour avant de confier la base au thread de l'AsyncDatabase
+        init_db(path)
+        adb = AsyncDatabase(open_database(path))
+        debut = timeit.default_timer()
+        results = asyncio.run(_async_parties(adb, n, provider))
+        duree = timeit.default_timer() - debut
+        open_database(path).close()
+    terminees = sum(r['fin'] == 'terminee' for r in results)
+    print(f"{n} parties simultanées en {duree:.2f} s ({terminees} terminées)")
+    print(f"{adb.requetes} requêtes en {adb.lots} lots ({adb.requetes / max(1, adb.lots):.1f} par commit)")
+
+# ---------------------------
+# Journal des combats
+# ---------------------------
+# combat_machine pose une ligne par tour dans un tampon en mémoire (un append) ;
+# un thread l'écrit dans CombatLog par gros paquets avec executemany.
+
+# lignes gardées en mémoire au plus ; au-delà elles sont perdues (et comptées)
+TELEMETRY_CAPACITY = 100000
+# le thread écrit au plus tard toutes les TELEMETRY_INTERVAL secondes,
+# ou dès que le tampon est rempli à moitié
+TELEMETRY_INTERVAL = 0.5
+# une écriture ratée (base verrouillée...) remet son paquet dans le tampon ;
+# à l'arrêt on réessaie encore TELEMETRY_RETRIES fois avant de compter les lignes perdues
+TELEMETRY_RETRIES = 5
+
+class CombatTelemetry:
+    """
+    Tampon borné des tours de combat + thread d'écriture dans CombatLog.
+    record() ne bloque jamais : si le tampon est plein la ligne est comptée dans dropped.
+    Une écriture qui échoue ne tue pas le thread : le paquet retourne dans le tampon,
+    failures compte les échecs et close() les signale.
+    """
+    def __init__(self, db, capacity=TELEMETRY_CAPACITY, interval=TELEMETRY_INTERVAL):
+        self.db = db
+        self.capacity = capacity
+        self.high_water = capacity // 2
+        self.interval = interval
+        self.buffer = collections.deque()
+        self.dropped = 0
+        self.written = 0
+        self.failures = 0
+        self.last_error = None
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._writer, name="fantasy-journal", daemon=True)
+        self.thread.start()
+
+    def record(self, row):
+        """row: (id_joueur, id_ennemi, tour, choix, degats_infliges, degats_subis, pv_joueur, pv_ennemi, issue)"""
+        buffer = self.buffer
+        if len(buffer) >= self.capacity:
+            self.dropped += 1
+            return
+        buffer.append(row)
+        # le tampon se remplit trop vite : on réveille le thread sans attendre l'intervalle
+        if len(buffer) >= self.high_water:
+            self.wake.set()
+
+    def _drain(self, cur, conn):
+        buffer = self.buffer
+        rows = [buffer.popleft() for _ in range(len(buffer))]
+        if not rows:
+            return True
+        try:
+            cur.executemany(QUERIES['journal_combat'], rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            # remis en tête du tampon, dans l'ordre, pour le prochain passage
+            buffer.extendleft(reversed(rows))
+            self.failures += 1
+            self.last_error = e
+            return False
+        self.written += len(rows)
+        return True
+
+    def _writer(self):
+        conn = self.db.connection()
+        cur = conn.cursor()
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self._drain(cur, conn)
+        for _ in range(TELEMETRY_RETRIES):
+            if self._drain(cur, conn):
+                return
+            time.sleep(self.interval)
+        # la base reste inaccessible : ce qui n'a pas pu être écrit est perdu
+        self.dropped += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        """
+        Ecrit ce qui reste et arrête le thread (on peut l'appeler plusieurs fois).
+        Renvoie le nombre d'écritures ratées, signalées une seule fois au joueur.
+        """
+        if self.thread.is_alive():
+            self.running = False
+            self.wake.set()
+            self.thread.join()
+            if self.failures:
+                print(f"Journal des combats : {self.failures} écriture(s) ratée(s) "
+                      f"(dernière erreur : {self.last_error}), {self.dropped} tour(s) perdu(s)")
+        return self.failures
+
+def telemetry_cli(args):
+    """python "The Fantasy.py" --journal [parties] : coût du journal des combats et ce qu'il contient."""
+    n = int(args[0]) if args else 300
+    with tempfile.TemporaryDirectory() as dossier:
+        path = os.path.join(dossier, DB)
+        conn, cur = init_db(path)
+        durees = {}
+        for avec_journal in (False, True):
+            journal = CombatTelemetry(open_database(path)) if avec_journal else None
+            debut = timeit.default_timer()
+            for i in range(n):
+                id_joueur = create_player(cur, conn, f"Bot {i}", 1 + i % 10)
+                session = Session(i, decide=ScriptedDecisions(), output=NULL_FRAMES)
+                session.telemetry = journal
+                play_adventure(cur, conn, session, id_joueur=id_joueur)
+            durees[avec_journal] = timeit.default_timer() - debut
+            if journal is not None:
+                journal.close()
+        print(f"{n} parties : {durees[False]:.2f} s sans journal, {durees[True]:.2f} s avec")
+        print(f"{journal.written} tours écrits, {journal.dropped} perdus, {journal.failures} écritures ratées")
+        cur.execute("""SELECT id_ennemi, COUNT(*) FROM CombatLog WHERE issue = 'defaite'
+                       GROUP BY id_ennemi ORDER BY COUNT(*) DESC LIMIT 3""")
+        for id_ennemi, morts in cur.fetchall():
+            print(f"  {morts:5} héros tués par {enemy_catalog().by_id[id_ennemi].nom}")
+        open_database(path).close()
+
+# ---------------------------
+# Héros synthétiques
+# ---------------------------
+HEROS_DB = "heros_synthetiques.db"
+_SYLLABES = ("ka", "lo", "mi", "ra", "zé", "tor", "an", "el", "dru", "fy", "gon", "is", "ul", "ber", "na")
+
+def generate_heroes(cur, conn, n, nb_comptes=10000, seed=0, batch=50000):
+    """Ajoute n héros au hasard (noms, classes, niveaux), par paquets de batch lignes."""
+    rng = random.Random(seed)
+    classes = {c[0]: c for c in fetch_classes(cur)}
+    comps = {id_classe: fetch_comp_for_class(cur, id_classe) for id_classe in classes}
+    faits = 0
+    while faits < n:
+        rows = []
+        for _ in range(min(batch, n - faits)):
+            id_classe = rng.choice(list(classes))
+            comp = comps[id_classe]
+            exp = int(rng.expovariate(1 / 300))
+            nom = ''.join(rng.choice(_SYLLABES) for _ in range(rng.randint(2, 4))).capitalize()
+            boss = min(5 * rng.randint(0, 3), exp // 100)
+            tours = rng.randint(60, 400) if boss >= 5 and rng.random() < 0.3 else None
+            rows.append((nom, id_classe, comp[0], exp, rng.randint(0, 200), classes[id_classe][3] + comp[4] + exp // 10,
+                         1 + exp // 20, f"compte{rng.randrange(nb_comptes)}", boss, tours))
+        cur.executemany(QUERIES['heros_synthetique'], rows)
+        conn.commit()
+        faits += len(rows)
+
+def _query_ms(fn, repeat=200):
+    return timeit.timeit(fn, number=repeat) / repeat * 1000
+
+def heros_cli(args):
+    """python "The Fantasy.py" --heros [nombre] [fichier] : remplit une base de héros et mesure les recherches."""
+    n = int(args[0]) if args else 1000000
+    path = args[1] if len(args) > 1 else HEROS_DB
+    conn, cur = init_db(path)
+    cur.execute("SELECT COUNT(*) FROM Joueur")
+    deja = cur.fetchone()[0]
+    if deja < n:
+        debut = timeit.default_timer()
+        generate_heroes(cur, conn, n - deja, seed=deja)
+        print(f"{n - deja} héros générés en {timeit.default_timer() - debut:.1f} s")
+    cur.execute("SELECT COUNT(*) FROM Joueur")
+    total = cur.fetchone()[0]
+    # un héros existant pour les recherches, et le milieu du classement pour la pagination
+    cur.execute("SELECT compte, nom FROM Joueur WHERE id_joueur = ?", (total // 2,))
+    compte, nom = cur.fetchone()
+    milieu = top_players(cur, limit=total // 2)[-1]
+    print(f"{total} héros dans {path} :")
+    print(f"  héros par compte et nom    : {_query_ms(lambda: find_player(cur, compte, nom)):.3f} ms")
+    print(f"  héros par id               : {_query_ms(lambda: get_player(cur, total // 2)):.3f} ms")
+    print(f"  page de héros d'un compte  : {_query_ms(lambda: list_players(cur, compte)):.3f} ms")
+    print(f"  top 10                     : {_query_ms(lambda: top_players(cur)):.3f} ms")
+    print(f"  page au milieu du classement : {_query_ms(lambda: top_players(cur, after=(milieu[3], milieu[4], milieu[0]))):.3f} ms")
+    for tableau in LEADERBOARDS:
+        print(f"  top 10 '{tableau}'{' ' * (7 - len(tableau))}          : {_query_ms(lambda: leaderboard(cur, tableau)):.3f} ms"
+              f" | mon rang : {_query_ms(lambda: player_rank(cur, total // 2, tableau)):.3f} ms")
+    print(f"  stats par classe           : {_query_ms(lambda: class_stats(cur)):.3f} ms")
     conn.close()
 
+# Modes sans interface : python "The Fantasy.py" --simulation ...
+COMMANDES = {
+    '--simulation': simulation_cli,
+    '--solveur': solveur_cli,
+    '--bench-etat': bench_state_cli,
+    '--replay': replay_cli,
+    '--raid': raid_cli,
+    '--ia': ia_cli,
+    '--lot': lot_cli,
+    '--multi': multi_cli,
+    '--reprendre': reprendre_cli,
+    '--heros': heros_cli,
+    '--async': async_cli,
+    '--journal': telemetry_cli,
+    '--classement': classement_cli,
+    '--memoire': memoire_cli,
+}
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDES:
+        COMMANDES[sys.argv[1]](sys.argv[2:])
+        sys.exit()
     try:
         main()
     except Exception as e: